@@ -0,0 +1,21 @@
+from django.urls import URLPattern
+
+from . import async_views
+from .urls import router_v1
+from .urls import urlpatterns as sync_urlpatterns
+
+app_name = 'api'
+
+ASYNC_VIEWS = {
+    'recipe-list': async_views.recipe_list,
+    'recipe-detail': async_views.recipe_detail,
+    'user-subscriptions': async_views.subscriptions,
+    'tag-list': async_views.reference_list,
+    'ingredient-list': async_views.reference_list,
+}
+
+urlpatterns = [
+    URLPattern(pattern.pattern, ASYNC_VIEWS[pattern.name](pattern.callback),
+               pattern.default_args, pattern.name)
+    for pattern in router_v1.urls if pattern.name in ASYNC_VIEWS
+] + sync_urlpatterns
@@ -0,0 +1,255 @@
+"""Асинхронные обработчики горячих GET-запросов для работы под ASGI.
+
+В Django 3.2 нет асинхронного ORM, поэтому каждый запрос к базе
+выполняется в отдельном пуле потоков из ASYNC_DB_WORKERS потоков,
+у каждого из которых своё соединение с базой. Независимые запросы
+(страница, число строк, ViewerContext) отправляются одновременно,
+объекты одного ответа обрабатываются в одном потоке. Всё, что быстрый
+путь не обслуживает (анонимные запросы с кэшем ответов, не JSON,
+курсоры, ошибки, изменения), отдаёт обычное синхронное представление
+DRF в том же пуле.
+Соединения потоков пула постоянные и закрываются только после ошибок.
+"""
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F, Value
+from django.http import Http404, HttpResponse
+from foodgram.models import Recipe, User
+from rest_framework.authentication import get_authorization_header
+from rest_framework.exceptions import APIException
+from rest_framework.request import ForcedAuthentication, Request
+
+from .authentication import CachingTokenAuthentication
+from .metrics import current_timings, track_queries
+from .pagination import LimitCursorPagination
+from .renderers import ORJSONRenderer
+from .serializers import RecipeSerializer, SubscriptionSerializer
+from .viewer import ViewerContext
+
+JSON_ACCEPT = ('', '*/*', 'application/json')
+
+executor = None
+
+
+class UseSyncView(Exception):
+    """Запрос должно обслужить синхронное представление."""
+
+
+def db_executor():
+    global executor
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=settings.ASYNC_DB_WORKERS,
+            thread_name_prefix='async-db',
+        )
+    return executor
+
+
+def call(func, *args):
+    try:
+        with track_queries(current_timings.get()):
+            return func(*args)
+    finally:
+        for connection in connections.all():
+            if connection.errors_occurred:
+                if connection.is_usable():
+                    connection.errors_occurred = False
+                else:
+                    connection.close()
+
+
+async def run(func, *args):
+    """Выполнение синхронного кода с запросами к базе в пуле потоков."""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        db_executor(), partial(context.run, call, func, *args)
+    )
+
+
+def render_sync(view, request, args, kwargs):
+    response = view(request, *args, **kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+async def authenticate(request):
+    """Пользователь по заголовку Authorization: Token или None."""
+    auth = get_authorization_header(request).split()
+    if len(auth) != 2 or auth[0].lower() != b'token':
+        return None
+    authentication = CachingTokenAuthentication()
+    try:
+        return await run(authentication.authenticate_credentials,
+                         auth[1].decode())
+    except (APIException, UnicodeError):
+        return None
+
+
+def async_view(fast_path):
+    """Асинхронное представление с синхронным sync_view про запас.
+
+    fast_path(view, request) получает экземпляр набора представлений
+    DRF с запросом от аутентифицированного пользователя, прошедшим
+    initial() с проверкой прав и ограничением частоты, и возвращает
+    данные ответа. UseSyncView, Http404 и ошибки DRF передают GET-запрос
+    синхронному представлению, чтобы ответ об ошибке был тем же.
+    Прочие исключения - ошибки в коде, они не перехватываются.
+    """
+    def factory(sync_view):
+        @wraps(sync_view)
+        async def view(request, *args, **kwargs):
+            if (request.method == 'GET' and 'format' not in kwargs
+                    and 'format' not in request.GET
+                    and request.headers.get('Accept', '') in JSON_ACCEPT):
+                credentials = await authenticate(request)
+                if credentials is not None:
+                    viewset = make_viewset(sync_view, request, credentials,
+                                           args, kwargs)
+                    try:
+                        await run(viewset.initial, viewset.request)
+                        data = await fast_path(viewset, viewset.request)
+                    except (UseSyncView, APIException, Http404):
+                        pass
+                    else:
+                        return json_response(viewset, data)
+            return await run(render_sync, sync_view, request, args, kwargs)
+        return view
+    return factory
+
+
+def make_viewset(sync_view, request, credentials, args, kwargs):
+    """Экземпляр набора представлений, как его готовит as_view()."""
+    actions = dict(sync_view.actions)
+    actions.setdefault('head', actions['get'])
+    viewset = sync_view.cls(**sync_view.initkwargs)
+    viewset.action_map = actions
+    for method, action in actions.items():
+        setattr(viewset, method, getattr(viewset, action))
+    viewset.request = Request(
+        request, authenticators=(ForcedAuthentication(*credentials),)
+    )
+    viewset.action = actions['get']
+    viewset.args = args
+    viewset.kwargs = kwargs
+    viewset.format_kwarg = None
+    viewset.headers = {}
+    return viewset
+
+
+def json_response(viewset, data):
+    response = HttpResponse(ORJSONRenderer().render(data),
+                            content_type='application/json')
+    response['Allow'] = ', '.join(viewset.allowed_methods)
+    response['Vary'] = 'Accept'
+    return response
+
+
+async def serialize_recipes(recipes, request, viewer):
+    """Ответ из снимков рецептов с отметками пользователя.
+
+    Связанные объекты загружаются только для рецептов без снимка,
+    в том же потоке, что и сериализация: экземпляры рецептов
+    не передаются между потоками одновременно.
+    """
+    request.viewer_context = viewer
+    return await run(lambda: RecipeSerializer(
+        recipes, many=True, context={'request': request}
+    ).data)
+
+
+async def paginate(viewset, queryset, request):
+    """Страница и число строк одновременно.
+
+    Номер страницы проверяется после получения числа строк, ответ
+    совпадает с ответом пагинатора DRF.
+    """
+    paginator = viewset.paginator
+    if (getattr(paginator, 'cursor_ordering', None)
+            and LimitCursorPagination.cursor_query_param
+            in request.query_params):
+        raise UseSyncView
+    page_size = paginator.get_page_size(request)
+    django_paginator = paginator.django_paginator_class(queryset, page_size)
+    try:
+        number = int(request.query_params.get(paginator.page_query_param, 1))
+    except ValueError:
+        raise UseSyncView
+    bottom = (number - 1) * page_size
+    count, rows = await asyncio.gather(
+        run(lambda: django_paginator.count),
+        run(lambda: list(queryset[max(bottom, 0):bottom + page_size])),
+    )
+    if number < 1 or (number > 1 and bottom >= count):
+        raise UseSyncView
+    paginator.page = django_paginator._get_page(rows, number,
+                                                django_paginator)
+    paginator.request = request
+    return rows
+
+
+@async_view
+async def recipe_list(viewset, request):
+    """Лента рецептов: страница, число и отметки одновременно."""
+    queryset = await run(viewset.filter_queryset, Recipe.objects.all())
+    recipes, viewer = await asyncio.gather(
+        paginate(viewset, queryset, request),
+        run(ViewerContext.load, request.user),
+    )
+    data = await serialize_recipes(recipes, request, viewer)
+    return viewset.paginator.get_paginated_response(data).data
+
+
+@async_view
+async def recipe_detail(viewset, request):
+    """Рецепт и отметки пользователя одновременно."""
+    recipe, viewer = await asyncio.gather(
+        run(viewset.get_object),
+        run(ViewerContext.load, request.user),
+    )
+    data = await serialize_recipes([recipe], request, viewer)
+    return data[0]
+
+
+@async_view
+async def subscriptions(viewset, request):
+    """Подписки: страница авторов и их последние рецепты."""
+    recipes_limit = request.query_params.get('recipes_limit')
+    try:
+        recipes_limit = int(recipes_limit) if recipes_limit else None
+    except ValueError:
+        raise UseSyncView
+    queryset = User.objects.filter(
+        subscribing__user=request.user
+    ).annotate(
+        is_subscribed=Value(True),
+        subscription_id=F('subscribing__id'),
+    ).order_by('-id')
+    authors = await paginate(viewset, queryset, request)
+    latest = {author.id: [] for author in authors}
+    for recipe in await run(lambda: list(
+            Recipe.objects.latest_by_author(authors, recipes_limit))):
+        latest[recipe.author_id].append(recipe)
+    for author in authors:
+        author.latest_recipes = latest[author.id]
+    data = await run(lambda: SubscriptionSerializer(
+        authors, many=True, context={'request': request}
+    ).data)
+    return viewset.paginator.get_paginated_response(data).data
+
+
+def reference_list(sync_view):
+    """Теги и ингредиенты отдаются из памяти процесса.
+
+    Запросов к базе на горячем пути нет, представление лишь
+    выполняется в пуле потоков, а не в потоке цикла событий.
+    """
+    @wraps(sync_view)
+    async def view(request, *args, **kwargs):
+        return await run(render_sync, sync_view, request, args, kwargs)
+    return view
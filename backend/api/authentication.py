@@ -0,0 +1,90 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+
+class TokenCache:
+    """Соответствие токен -> пользователь с ограничением по времени и размеру.
+
+    Первый уровень - словарь в памяти процесса, вытесняющий давно не
+    использованные записи. Второй, если включён AUTH_TOKEN_SHARED_CACHE, -
+    общий кэш Django. Сброс записи в одном процессе не виден другим,
+    поэтому локальные записи живут лишь AUTH_TOKEN_LOCAL_TIMEOUT секунд.
+    """
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def shared_key(key):
+        return f'auth:token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    return copy.copy(entry[0])
+                del self.entries[key]
+        if not settings.AUTH_TOKEN_SHARED_CACHE:
+            return None
+        user = cache.get(self.shared_key(key))
+        if user is not None:
+            self.store_local(key, user)
+        return user
+
+    def set(self, key, user):
+        self.store_local(key, user)
+        if settings.AUTH_TOKEN_SHARED_CACHE:
+            cache.set(self.shared_key(key), user,
+                      settings.AUTH_TOKEN_CACHE_TIMEOUT)
+
+    def store_local(self, key, user):
+        expires = time.monotonic() + settings.AUTH_TOKEN_LOCAL_TIMEOUT
+        with self.lock:
+            self.entries[key] = (copy.copy(user), expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.AUTH_TOKEN_LOCAL_SIZE:
+                self.entries.popitem(last=False)
+
+    def delete(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+        if settings.AUTH_TOKEN_SHARED_CACHE:
+            cache.delete_many([self.shared_key(key) for key in keys])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache()
+
+
+class CachingTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к базе для уже известного токена.
+
+    Записи сбрасываются сигналами при удалении токена (выход) и при
+    сохранении пользователя (смена пароля, деактивация).
+    """
+
+    def authenticate_credentials(self, key):
+        user = token_cache.get(key)
+        if user is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, user)
+            return user, token
+        if not user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return user, self.get_model()(key=key, user=user)
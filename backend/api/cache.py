@@ -0,0 +1,224 @@
+import hashlib
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework.renderers import JSONRenderer
+
+from .models import Generation
+from .renderers import ORJSONRenderer
+
+VARY_HEADERS = ('Accept', 'Authorization')
+
+cache_stats = Counter()
+
+reference_blobs = {}
+
+
+def get_generation(namespace):
+    """Поколение данных пространства имён.
+
+    Поколение - время последнего изменения данных в секундах, оно входит
+    в ключи кэша и служит значением Last-Modified. Без общего кэша
+    (GENERATIONS_IN_CACHE) поколения хранятся в таблице Generation,
+    чтобы смену поколения видели все процессы.
+    """
+    if not settings.GENERATIONS_IN_CACHE:
+        generation = Generation.objects.filter(
+            namespace=namespace
+        ).values_list('value', flat=True).first()
+        if generation is None:
+            generation = Generation.objects.get_or_create(
+                namespace=namespace,
+                defaults={'value': int(time.time())},
+            )[0].value
+        return generation
+    key = f'{namespace}:generation'
+    generation = cache.get(key)
+    if generation is None:
+        generation = int(time.time())
+        if not cache.add(key, generation, timeout=None):
+            generation = cache.get(key, generation)
+    return generation
+
+
+def bump_generation(namespace):
+    """Смена поколения: все закэшированные ответы перестают читаться.
+
+    В таблице Generation поколение меняется одним UPDATE ... RETURNING,
+    строка создаётся при первой смене. Если её успел создать другой
+    процесс, UPDATE повторяется.
+    """
+    if not settings.GENERATIONS_IN_CACHE:
+        now = int(time.time())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {Generation._meta.db_table} SET value = CASE '
+                f'WHEN value < %s THEN %s ELSE value + 1 END '
+                f'WHERE namespace = %s RETURNING value',
+                [now, now, namespace],
+            )
+            row = cursor.fetchone()
+        if row is not None:
+            return row[0]
+        row, created = Generation.objects.get_or_create(
+            namespace=namespace, defaults={'value': now}
+        )
+        if created:
+            return row.value
+        return bump_generation(namespace)
+    key = f'{namespace}:generation'
+    generation = max(int(time.time()), cache.get(key, 0) + 1)
+    cache.set(key, generation, timeout=None)
+    return generation
+
+
+def mark_in_transaction(key):
+    """Отметка key в текущей транзакции, False, если она уже стоит.
+
+    Отметка - пустой callback on_commit, поэтому она снимается вместе
+    с откатом точки сохранения, в которой поставлена, и с фиксацией.
+    Вне транзакции отметок нет и функция всегда возвращает True.
+    """
+    if not connection.in_atomic_block:
+        return True
+    if marked_in_transaction(key):
+        return False
+
+    def mark():
+        pass
+
+    mark.transaction_key = key
+    transaction.on_commit(mark)
+    return True
+
+
+def marked_in_transaction(key):
+    return connection.in_atomic_block and any(
+        getattr(callback[1], 'transaction_key', None) == key
+        for callback in connection.run_on_commit
+    )
+
+
+def unmark_in_transaction(key):
+    connection.run_on_commit = [
+        callback for callback in connection.run_on_commit
+        if getattr(callback[1], 'transaction_key', None) != key
+    ]
+
+
+def bump_generation_on_commit(namespace):
+    """Смена поколения после фиксации, одна на транзакцию."""
+    if mark_in_transaction(('generation', namespace)):
+        transaction.on_commit(lambda: bump_generation(namespace))
+
+
+class AnonymousCacheMixin:
+    """Кэширование ответов list и retrieve для анонимных пользователей.
+
+    Отрендеренный ответ хранится под ключом из поколения данных, формата
+    ответа и полного пути запроса. Клиенту отдаются ETag и
+    Last-Modified, на условные запросы отвечаем 304 без рендеринга.
+    """
+
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve,
+                                    request, *args, **kwargs)
+
+    def cached_response(self, view, request, *args, **kwargs):
+        if not request.user.is_anonymous:
+            return view(request, *args, **kwargs)
+        generation = get_generation(self.cache_namespace)
+        last_modified = http_date(generation)
+        if_modified_since = parse_http_date_safe(
+            request.headers.get('If-Modified-Since', '')
+        )
+        if if_modified_since and if_modified_since >= generation:
+            return self.not_modified(None, last_modified)
+        path = hashlib.md5(
+            f'{request.accepted_media_type}:{request.get_full_path()}'
+            .encode()
+        ).hexdigest()
+        key = f'{self.cache_namespace}:{generation}:{path}'
+        cached = cache.get(key)
+        if cached is None:
+            cache_stats[f'{self.cache_namespace}_miss'] += 1
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                response.add_post_render_callback(
+                    lambda rendered: self.store(key, rendered)
+                )
+            response['Last-Modified'] = last_modified
+            patch_vary_headers(response, VARY_HEADERS)
+            return response
+        cache_stats[f'{self.cache_namespace}_hit'] += 1
+        etag, content_type, content = cached
+        if etag in request.headers.get('If-None-Match', ''):
+            return self.not_modified(etag, last_modified)
+        response = HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        patch_vary_headers(response, VARY_HEADERS)
+        return response
+
+    def store(self, key, response):
+        etag = f'"{hashlib.md5(response.content).hexdigest()}"'
+        response['ETag'] = etag
+        cache.set(key, (etag, response['Content-Type'], response.content),
+                  settings.RESPONSE_CACHE_TIMEOUT)
+
+    def not_modified(self, etag, last_modified):
+        response = HttpResponseNotModified()
+        if etag:
+            response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        return response
+
+
+class ReferenceDataMixin:
+    """Отдача справочника целиком из памяти процесса.
+
+    Список сериализуется в JSON один раз на поколение данных. ETag
+    строится из поколения, поэтому условный запрос проверяется до
+    обращения к базе, а клиент может хранить ответ max-age секунд.
+    """
+
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        if (request.query_params
+                or not isinstance(request.accepted_renderer, JSONRenderer)):
+            return super().list(request, *args, **kwargs)
+        generation = get_generation(self.cache_namespace)
+        etag = f'"{self.cache_namespace}-{generation}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            cache_stats[f'{self.cache_namespace}_not_modified'] += 1
+            response = HttpResponseNotModified()
+        else:
+            blob = reference_blobs.get(self.cache_namespace)
+            if blob is None or blob[0] != generation:
+                cache_stats[f'{self.cache_namespace}_miss'] += 1
+                serializer = self.get_serializer(
+                    self.filter_queryset(self.get_queryset()), many=True
+                )
+                blob = (generation,
+                        ORJSONRenderer().render(serializer.data))
+                reference_blobs[self.cache_namespace] = blob
+            else:
+                cache_stats[f'{self.cache_namespace}_hit'] += 1
+            response = HttpResponse(blob[1],
+                                    content_type='application/json')
+        response['ETag'] = etag
+        patch_cache_control(response, public=True,
+                            max_age=settings.REFERENCE_DATA_MAX_AGE)
+        return response
@@ -0,0 +1,113 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from foodgram.models import Recipe
+from PIL import Image
+
+from .cache import bump_generation
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 6}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+executor = None
+
+
+def thumbnail_name(image_name, size, extension):
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return f'recipes/thumbs/{stem}-{size}.{extension}'
+
+
+def render_thumbnails(image_name):
+    """Уменьшенные копии картинки во всех размерах и форматах.
+
+    Исходник декодируется один раз, каждая копия сохраняется под
+    именем, производным от хэша исходника. Возвращает словарь
+    {размер: {формат: имя файла}}.
+    """
+    with default_storage.open(image_name) as file:
+        source = Image.open(file)
+        source.load()
+    if source.mode not in ('RGB', 'L'):
+        source = source.convert('RGB')
+    thumbnails = {}
+    for size, width in settings.RECIPE_IMAGE_SIZES.items():
+        image = source.copy()
+        image.thumbnail((width, width), Image.LANCZOS)
+        thumbnails[size] = {}
+        for extension, (image_format, options) in FORMATS.items():
+            name = thumbnail_name(image_name, size, extension)
+            if not default_storage.exists(name):
+                buffer = io.BytesIO()
+                image.save(buffer, image_format, **options)
+                default_storage.save(name, ContentFile(buffer.getvalue()))
+            thumbnails[size][extension] = name
+    return thumbnails
+
+
+def build_thumbnails(recipe_id):
+    """Построение уменьшенных картинок рецепта, если их ещё нет."""
+    recipe = Recipe.objects.only('image', 'thumbnails').get(pk=recipe_id)
+    if (not recipe.image
+            or recipe.thumbnails.get('source') == recipe.image.name):
+        return False
+    thumbnails = render_thumbnails(recipe.image.name)
+    thumbnails['source'] = recipe.image.name
+    Recipe.objects.filter(
+        pk=recipe_id, image=recipe.image.name
+    ).update(thumbnails=thumbnails)
+    Recipe.objects.filter(pk=recipe_id).invalidate_snapshots()
+    bump_generation('recipes')
+    return True
+
+
+def build_thumbnails_in_background(recipe_id):
+    close_old_connections()
+    try:
+        build_thumbnails(recipe_id)
+    except Exception:
+        logger.exception('Не удалось построить картинки рецепта %s',
+                         recipe_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_thumbnails(recipe_id):
+    """Постановка построения картинок в фоновый пул потоков.
+
+    При IMAGE_WORKERS = 0 картинки строятся сразу в текущем потоке.
+    """
+    global executor
+    if not settings.IMAGE_WORKERS:
+        build_thumbnails(recipe_id)
+        return
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix='recipe-images',
+        )
+    executor.submit(build_thumbnails_in_background, recipe_id)
+
+
+def thumbnail_urls(recipe, request=None):
+    """Ссылки на уменьшенные картинки рецепта по размерам и форматам."""
+    urls = {}
+    for size, formats in recipe.thumbnails.items():
+        if size == 'source':
+            continue
+        urls[size] = {}
+        for extension, name in formats.items():
+            url = default_storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls[size][extension] = url
+    return urls
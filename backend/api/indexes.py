@@ -0,0 +1,276 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter, defaultdict
+from heapq import merge
+from itertools import islice, repeat
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import transaction
+from foodgram.models import Ingredient, IngredientForRecipe
+
+from .cache import bump_generation, get_generation, mark_in_transaction
+
+
+class IngredientIndex:
+    """Индекс ингредиентов для автодополнения по названию.
+
+    Ингредиенты хранятся в памяти процесса, отсортированными по названию
+    в нижнем регистре, поэтому совпадения по началу названия находятся
+    двоичным поиском. Индекс строится при первом обращении и
+    перестраивается, когда меняется поколение справочника ингредиентов
+    в общем кэше, то есть после изменений в любом процессе. Для поиска
+    по вхождению названия склеены в одну строку, которую просматривает
+    str.find. Индекс с live=False не читает базу и содержит только то,
+    что передано в build().
+    """
+
+    separator = '\n'
+
+    fields = ('id', 'name', 'measurement_unit')
+
+    def __init__(self, live=True):
+        self._lock = threading.Lock()
+        self._data = None
+        self._generation = None
+        self.live = live
+
+    def build(self, ingredients):
+        """Построение индекса из словарей с полями id, name и unit."""
+        entries = sorted(
+            ((ingredient['name'].casefold(), ingredient)
+             for ingredient in ingredients),
+            key=lambda entry: (entry[0], entry[1]['id']),
+        )
+        keys = [key for key, _ in entries]
+        values = [value for _, value in entries]
+        offsets = []
+        position = 0
+        for key in keys:
+            offsets.append(position)
+            position += len(key) + len(self.separator)
+        self._data = (keys, values, self.separator.join(keys), offsets)
+        return self._data
+
+    def get_data(self):
+        if not self.live:
+            return self._data
+        generation = get_generation('ingredients')
+        if self._data is not None and self._generation == generation:
+            return self._data
+        with self._lock:
+            if self._data is None or self._generation != generation:
+                self.build(Ingredient.objects.values(*self.fields))
+                self._generation = generation
+            return self._data
+
+    def search(self, query, limit=None):
+        """Ингредиенты, название которых начинается с query.
+
+        Если таких меньше limit, список дополняется ингредиентами,
+        в названии которых query встречается не в начале.
+        """
+        if limit is None:
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        query = query.casefold().replace(self.separator, '')
+        keys, values, text, offsets = self.get_data()
+        result = []
+        position = bisect_left(keys, query)
+        while (position < len(keys) and len(result) < limit
+               and keys[position].startswith(query)):
+            result.append(values[position])
+            position += 1
+        found = text.find(query) if query else -1
+        while found != -1 and len(result) < limit:
+            position = bisect_right(offsets, found) - 1
+            if found != offsets[position]:
+                result.append(values[position])
+            if position + 1 == len(offsets):
+                break
+            found = text.find(query, offsets[position + 1])
+        return result
+
+
+class PantryIndex:
+    """Обратный индекс «ингредиент - рецепты» для подбора по продуктам.
+
+    Для каждого ингредиента хранится отсортированный массив id рецептов,
+    для каждого рецепта - массив id его ингредиентов. Подбор считает,
+    сколько ингредиентов каждого рецепта есть у пользователя, проходом
+    по массивам выбранных ингредиентов, без запросов к базе.
+
+    После сохранения или удаления рецепта процесс, в котором это
+    произошло, правит индекс на месте и, если набор ингредиентов
+    изменился, меняет поколение 'pantry'. Остальные процессы сверяют
+    поколение не чаще раза в PANTRY_INDEX_MAX_AGE секунд и по новому
+    поколению строят индекс заново, так что поток изменений рецептов
+    вызывает не больше одной перестройки за этот срок.
+    """
+
+    typecode = 'I'
+
+    def __init__(self, live=True):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._data = None
+        self._generation = None
+        self._checked_at = None
+        self.live = live
+
+    def build(self, pairs):
+        """Построение индекса из пар (id рецепта, id ингредиента)."""
+        postings = defaultdict(lambda: array(self.typecode))
+        recipes = defaultdict(lambda: array(self.typecode))
+        for recipe_id, ingredient_id in sorted(pairs):
+            postings[ingredient_id].append(recipe_id)
+            recipes[recipe_id].append(ingredient_id)
+        self._data = (dict(postings), dict(recipes))
+        return self._data
+
+    def get_data(self):
+        if not self.live:
+            return self._data
+        now = time.monotonic()
+        if (self._data is not None and now - self._checked_at
+                < settings.PANTRY_INDEX_MAX_AGE):
+            return self._data
+        generation = get_generation('pantry')
+        with self._lock:
+            if self._data is None or self._generation != generation:
+                self.build(IngredientForRecipe.objects.values_list(
+                    'recipe_id', 'ingredient_id'
+                ).iterator())
+                self._generation = generation
+            self._checked_at = now
+            return self._data
+
+    def schedule_update(self, recipe_id):
+        """Обновление рецепта в индексе после фиксации транзакции."""
+        pending = getattr(self._local, 'pending', None)
+        if pending is None:
+            pending = self._local.pending = set()
+        pending.add(recipe_id)
+        if mark_in_transaction(('pantry', id(self))):
+            transaction.on_commit(self.flush)
+
+    def flush(self):
+        pending = getattr(self._local, 'pending', None)
+        if pending:
+            self._local.pending = set()
+            self.update(pending)
+
+    def update(self, recipe_ids):
+        """Замена ингредиентов рецептов на текущие из базы."""
+        current = defaultdict(list)
+        for recipe_id, ingredient_id in IngredientForRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('recipe_id', 'ingredient_id'):
+            current[recipe_id].append(ingredient_id)
+        with self._lock:
+            fresh = (self._data is not None
+                     and self._generation == get_generation('pantry'))
+            if fresh:
+                postings, recipes = self._data
+                changed = False
+                for recipe_id in recipe_ids:
+                    ingredient_ids = sorted(current[recipe_id])
+                    if list(recipes.get(recipe_id, ())) == ingredient_ids:
+                        continue
+                    changed = True
+                    self.remove(postings, recipes, recipe_id)
+                    if ingredient_ids:
+                        self.add(postings, recipes, recipe_id,
+                                 ingredient_ids)
+                if not changed:
+                    return
+            generation = bump_generation('pantry')
+            if fresh:
+                self._generation = generation
+
+    def remove(self, postings, recipes, recipe_id):
+        for ingredient_id in recipes.pop(recipe_id, ()):
+            posting = postings[ingredient_id]
+            position = bisect_left(posting, recipe_id)
+            if position < len(posting) and posting[position] == recipe_id:
+                del posting[position]
+            if not posting:
+                del postings[ingredient_id]
+
+    def add(self, postings, recipes, recipe_id, ingredient_ids):
+        recipes[recipe_id] = array(self.typecode, sorted(ingredient_ids))
+        for ingredient_id in recipes[recipe_id]:
+            insort(postings.setdefault(ingredient_id,
+                                       array(self.typecode)), recipe_id)
+
+    def match(self, ingredient_ids):
+        """Рецепты, в которых есть хотя бы один из ингредиентов.
+
+        Рецепты раскладываются по корзинам с одинаковыми числом
+        найденных и общим числом ингредиентов. Сортируются только
+        корзины, а их содержимое - при обращении к нужной странице.
+        """
+        postings, recipes = self.get_data()
+        found = Counter()
+        for ingredient_id in set(ingredient_ids):
+            found.update(postings.get(ingredient_id, ()))
+        buckets = defaultdict(list)
+        for recipe_id, count in found.items():
+            total = len(recipes.get(recipe_id, ()))
+            if count <= total:
+                buckets[count, total].append(recipe_id)
+        return PantryMatches(buckets)
+
+
+class PantryMatches:
+    """Результат подбора по продуктам в порядке ранжирования.
+
+    Элементы - кортежи (id рецепта, найдено, всего ингредиентов),
+    отсортированные по доле найденных ингредиентов, затем по числу
+    недостающих и по убыванию id. Поддерживает len() и срезы, чего
+    достаточно для пагинатора.
+    """
+
+    def __init__(self, buckets):
+        groups = defaultdict(list)
+        for (found, total), recipe_ids in buckets.items():
+            groups[-found / total, total - found].append(
+                (found, total, recipe_ids)
+            )
+        self.groups = [groups[rank] for rank in sorted(groups)]
+        self.count = sum(len(recipe_ids) for recipe_ids in buckets.values())
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            position = index + self.count if index < 0 else index
+            if not 0 <= position < self.count:
+                raise IndexError(index)
+            return self[position:position + 1][0]
+        start, stop, _ = index.indices(self.count)
+        result = []
+        offset = 0
+        for group in self.groups:
+            size = sum(len(recipe_ids) for _, _, recipe_ids in group)
+            if offset + size > start and offset < stop:
+                for _, _, recipe_ids in group:
+                    recipe_ids.sort(reverse=True)
+                result.extend(islice(
+                    merge(*(
+                        zip(recipe_ids, repeat(found), repeat(total))
+                        for found, total, recipe_ids in group
+                    ), key=itemgetter(0), reverse=True),
+                    max(start - offset, 0), stop - offset,
+                ))
+            offset += size
+            if offset >= stop:
+                break
+        return result
+
+
+ingredient_index = IngredientIndex()
+
+pantry_index = PantryIndex()
@@ -0,0 +1,467 @@
+import asyncio
+import itertools
+import json
+import random
+import re
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from api import async_views
+from api.indexes import IngredientIndex, PantryIndex
+from api.renderers import ORJSONRenderer
+from api.serializers import (PantryRecipeSerializer, RecipeSerializer,
+                             SubscriptionSerializer, snapshot_lookups)
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import F, Value, prefetch_related_objects
+from django.test import AsyncClient, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
+from foodgram.models import Ingredient, Recipe, Tag, User
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, round(percent / 100 * (len(values) - 1)))
+    return values[index]
+
+
+class Command(BaseCommand):
+    help = 'Замеры производительности узких мест API.'
+
+    scenarios = ('asgi', 'autocomplete', 'http', 'pagination', 'pantry',
+                 'search', 'serializers')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=self.scenarios)
+        parser.add_argument('--size', type=int, action='append',
+                            help='Размер набора данных, можно несколько.')
+        parser.add_argument('--repeat', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--page', type=int, default=10000,
+                            help='Дальняя страница для сравнения.')
+        parser.add_argument('--page-size', type=int, default=6)
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Число одновременных запросов.')
+        parser.add_argument('--concurrency', type=int,
+                            help='Число одновременных запросов к '
+                                 'асинхронным представлениям, по '
+                                 'умолчанию 4 * threads.')
+        parser.add_argument('--output',
+                            help='Файл для сохранения результатов в JSON.')
+        parser.add_argument('--compare',
+                            help='JSON с прошлыми результатами для '
+                                 'сравнения.')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.clients = threading.local()
+        getattr(self, f"bench_{options['scenario']}")(**options)
+
+    def report(self, name, timings):
+        self.stdout.write(
+            f'{name}: p50 {percentile(timings, 50) * 1000:.3f} мс, '
+            f'p99 {percentile(timings, 99) * 1000:.3f} мс, '
+            f'максимум {max(timings) * 1000:.3f} мс'
+        )
+
+    def random_word(self, length):
+        return ''.join(self.random.choice('абвгдеёжзиклмнопрстуфхцчшыэюя')
+                       for _ in range(length))
+
+    def bench_autocomplete(self, size=None, repeat=1000, **options):
+        """Поиск по индексу ингредиентов на синтетических каталогах."""
+        for catalog_size in size or (2000, 100000):
+            index = IngredientIndex(live=False)
+            index.build(
+                {'id': pk,
+                 'name': f'{self.random_word(6)} {self.random_word(8)}',
+                 'measurement_unit': 'г'}
+                for pk in range(catalog_size)
+            )
+            queries = [self.random_word(self.random.randint(1, 4))
+                       for _ in range(repeat)]
+            queries += [self.random.choice(string.ascii_lowercase)
+                        for _ in range(repeat // 10)]
+            timings = []
+            for query in queries:
+                started = time.perf_counter()
+                index.search(query)
+                timings.append(time.perf_counter() - started)
+            self.report(f'Каталог {catalog_size}', timings)
+
+    def time_query(self, queryset, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            list(queryset.all())
+            timings.append(time.perf_counter() - started)
+        return timings
+
+    def bench_pagination(self, page=10000, page_size=6, repeat=1000,
+                         **options):
+        """OFFSET против курсора на первой и дальней странице.
+
+        Курсор, как и в RecipePagination, фильтрует по pub_date
+        предыдущей страницы. Позиция дальней страницы находится заранее
+        и в замер не входит, как и у клиента, пришедшего по ссылке next.
+        """
+        repeat = min(repeat, 100)
+        recipes = Recipe.objects.order_by('-pub_date', '-id')
+        total = recipes.count()
+        page = min(page, max(1, total // page_size))
+        offset = (page - 1) * page_size
+        self.stdout.write(f'Рецептов: {total}, дальняя страница: {page}')
+        for number, start in ((1, 0), (page, offset)):
+            self.report(
+                f'OFFSET, страница {number}',
+                self.time_query(
+                    recipes.values_list('id', flat=True)[
+                        start:start + page_size
+                    ],
+                    repeat,
+                ),
+            )
+            if start == 0:
+                keyset = recipes
+            else:
+                pub_date = recipes.values_list('pub_date', flat=True)[start]
+                keyset = recipes.filter(pub_date__lt=pub_date)
+            self.report(
+                f'Курсор, страница {number}',
+                self.time_query(
+                    keyset.values_list('id', flat=True)[:page_size], repeat
+                ),
+            )
+
+    def bench_pantry(self, size=None, repeat=1000, **options):
+        """Подбор рецептов по продуктам на синтетическом индексе.
+
+        У рецепта 5-12 ингредиентов из каталога в 2000 позиций, частота
+        ингредиентов неравномерная, как у соли и муки в реальной базе.
+        """
+        repeat = min(repeat, 200)
+        for recipes_count in size or (10000, 100000):
+            index = PantryIndex(live=False)
+            index.build(
+                (recipe_id, ingredient_id)
+                for recipe_id in range(recipes_count)
+                for ingredient_id in {
+                    int(self.random.paretovariate(1)) % 2000
+                    for _ in range(self.random.randint(5, 12))
+                }
+            )
+            timings = []
+            for _ in range(repeat):
+                ingredients = [int(self.random.paretovariate(1)) % 2000
+                               for _ in range(self.random.randint(3, 8))]
+                started = time.perf_counter()
+                index.match(ingredients)[:6]
+                timings.append(time.perf_counter() - started)
+            self.report(f'Рецептов {recipes_count}', timings)
+
+    def bench_search(self, page_size=6, repeat=1000, **options):
+        """Полнотекстовый поиск по словам из названий рецептов.
+
+        Замеряется первая страница выдачи с ранжированием, как при
+        запросе /api/recipes/?search=.
+        """
+        repeat = min(repeat, 100)
+        total = Recipe.objects.count()
+        names = list(Recipe.objects.order_by('?').values_list(
+            'name', flat=True)[:repeat])
+        words = [word for name in names for word in re.findall(r'\w+', name)
+                 if len(word) > 2]
+        if not words:
+            raise CommandError('Нет рецептов для поиска.')
+        self.stdout.write(f'Рецептов: {total}')
+        timings = []
+        for _ in range(repeat):
+            queryset = Recipe.objects.search(self.random.choice(words))
+            started = time.perf_counter()
+            list(queryset.values_list('id', flat=True)[:page_size])
+            timings.append(time.perf_counter() - started)
+        self.report('Поиск', timings)
+
+    def bench_serializers(self, repeat=1000, page_size=6, **options):
+        """Стоимость сериализации ответов и их отрисовки.
+
+        Рецепты отдаются из снимков, для них отдельно замеряется сборка
+        снимка. Совпадение вывода с эталоном DRF проверяет
+        SerializerOutputTest.
+        """
+        repeat = min(repeat, 200)
+        user, _ = self.benchmark_user()
+        request = Request(RequestFactory().get('/api/recipes/',
+                                               SERVER_NAME='localhost'))
+        request.user = user
+        recipes = list(Recipe.objects.all()[:page_size])
+        pantry = list(Recipe.objects.all()[:page_size])
+        for number, recipe in enumerate(pantry, start=1):
+            recipe.coverage = 1 / number
+            recipe.missing_ingredients = number - 1
+        prefetch_related_objects(recipes + pantry, *snapshot_lookups())
+        authors = list(User.objects.filter(
+            subscribing__user=user
+        ).annotate(
+            is_subscribed=Value(True),
+            subscription_id=F('subscribing__id'),
+        ).order_by('-id')[:page_size])
+        latest = {author.id: [] for author in authors}
+        for recipe in Recipe.objects.latest_by_author(authors, 3):
+            latest[recipe.author_id].append(recipe)
+        for author in authors:
+            author.latest_recipes = latest[author.id]
+        cases = {
+            'Рецепты': (RecipeSerializer, recipes),
+            'Подбор по ингредиентам': (PantryRecipeSerializer, pantry),
+            'Подписки': (SubscriptionSerializer, authors),
+        }
+        renderers = {'JSONRenderer': JSONRenderer(),
+                     'ORJSONRenderer': ORJSONRenderer()}
+        for name, (serializer_class, objects) in cases.items():
+            if not objects:
+                raise CommandError(f'{name}: нет данных, запустите '
+                                   f'seed_data.')
+
+            def serialize():
+                return serializer_class(objects, many=True,
+                                        context={'request': request}).data
+
+            data = serialize()
+            timings = self.time_call(serialize, repeat)
+            cost = percentile(timings, 50) / len(objects)
+            self.stdout.write(f'{name}: {cost * 1e6:.1f} мкс на объект')
+            if issubclass(serializer_class, RecipeSerializer):
+                serializer = serializer_class(context={'request': request})
+                snapshot_timings = self.time_call(
+                    lambda: [serializer.get_snapshot(recipe)
+                             for recipe in objects],
+                    repeat,
+                )
+                cost = percentile(snapshot_timings, 50) / len(objects)
+                self.stdout.write(f'  сборка снимка: {cost * 1e6:.1f} '
+                                  f'мкс на объект')
+            for renderer_name, renderer in renderers.items():
+                render_timings = self.time_call(
+                    lambda: renderer.render(data), repeat
+                )
+                cost = percentile(render_timings, 50) / len(objects)
+                self.stdout.write(f'  {renderer_name}: {cost * 1e6:.1f} '
+                                  f'мкс на объект')
+
+    def time_call(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return timings
+
+    def bench_http(self, threads=8, repeat=1000, output=None, compare=None,
+                   **options):
+        """Пропускная способность и задержки основных эндпоинтов.
+
+        Рецепты запрашиваются со всеми сочетаниями фильтров RecipeFilter.
+        Число SQL-запросов считается на повторном запросе без
+        конкуренции, задержки - при threads одновременных запросах.
+        Данные удобно готовить командой seed_data.
+        """
+        repeat = min(repeat, 200)
+        user, token = self.benchmark_user()
+        results = {}
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for name, url, authorized in self.http_endpoints(user):
+                key = token if authorized else None
+                self.fetch(url, key)
+                with CaptureQueriesContext(connection) as queries:
+                    status, _ = self.fetch(url, key)
+                started = time.perf_counter()
+                timings = [duration for _, duration in executor.map(
+                    lambda _: self.fetch(url, key), range(repeat)
+                )]
+                elapsed = time.perf_counter() - started
+                results[name] = {
+                    'url': url,
+                    'status': status,
+                    'queries': len(queries),
+                    'rps': round(repeat / elapsed, 1),
+                    'p50': round(percentile(timings, 50) * 1000, 3),
+                    'p95': round(percentile(timings, 95) * 1000, 3),
+                    'p99': round(percentile(timings, 99) * 1000, 3),
+                }
+                self.stdout.write(
+                    f'{name}: {status}, запросов {len(queries)}, '
+                    f'{results[name]["rps"]} RPS, '
+                    f'p50 {results[name]["p50"]} мс, '
+                    f'p95 {results[name]["p95"]} мс, '
+                    f'p99 {results[name]["p99"]} мс'
+                )
+        if compare:
+            self.compare_results(compare, results)
+        if output:
+            with open(output, 'w', encoding='utf-8') as file:
+                json.dump({
+                    'created': timezone.now().isoformat(),
+                    'database': connection.vendor,
+                    'threads': threads,
+                    'repeat': repeat,
+                    'recipes': Recipe.objects.count(),
+                    'users': User.objects.count(),
+                    'results': results,
+                }, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Результаты сохранены в {output}')
+
+    def benchmark_user(self):
+        user = User.objects.filter(
+            shopping_cart__isnull=False, subscriber__isnull=False,
+            favorites__isnull=False,
+        ).order_by('id').first()
+        if user is None:
+            raise CommandError('Нужен пользователь с корзиной, избранным и '
+                               'подписками, запустите seed_data.')
+        token, _ = Token.objects.get_or_create(user=user)
+        return user, token
+
+    def http_endpoints(self, user):
+        recipe = Recipe.objects.order_by('-favorites_count').first()
+        tags = list(Tag.objects.order_by('id').values_list('slug',
+                                                           flat=True)[:2])
+        ingredient = Ingredient.objects.order_by('id').first()
+        word = re.findall(r'\w+', recipe.name)[0]
+        filters = {
+            'tags': '&'.join(f'tags={slug}' for slug in tags),
+            'author': f'author={recipe.author_id}',
+            'is_favorited': 'is_favorited=1',
+            'is_in_shopping_cart': 'is_in_shopping_cart=1',
+            'search': urlencode({'search': word}),
+        }
+        for count in range(len(filters) + 1):
+            for names in itertools.combinations(filters, count):
+                query = '&'.join(filters[name] for name in names)
+                yield (f'recipes {"+".join(names)}'.strip(),
+                       f'/api/recipes/?{query}', True)
+        yield 'recipes аноним', '/api/recipes/', False
+        yield 'subscriptions', '/api/users/subscriptions/', True
+        yield ('download_shopping_cart',
+               '/api/recipes/download_shopping_cart/', True)
+        query = urlencode({'name': ingredient.name[:2]})
+        yield 'autocomplete', f'/api/ingredients/?{query}', True
+
+    def fetch(self, url, token=None):
+        """GET-запрос с чтением всего тела; статус и время ответа."""
+        client = getattr(self.clients, 'client', None)
+        if client is None:
+            client = self.clients.client = Client(
+                SERVER_NAME='localhost', raise_request_exception=False
+            )
+        headers = {}
+        if token is not None:
+            headers['HTTP_AUTHORIZATION'] = f'Token {token.key}'
+        started = time.perf_counter()
+        response = client.get(url, **headers)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response.status_code, time.perf_counter() - started
+
+    def compare_results(self, path, results):
+        with open(path, encoding='utf-8') as file:
+            previous = json.load(file)['results']
+        self.stdout.write(f'Сравнение с {path}:')
+        for name, result in results.items():
+            if name not in previous:
+                continue
+            before = previous[name]
+            change = (result['p50'] / before['p50'] - 1) * 100
+            self.stdout.write(
+                f'{name}: p50 {before["p50"]} -> {result["p50"]} мс '
+                f'({change:+.0f}%), запросов {before["queries"]} -> '
+                f'{result["queries"]}'
+            )
+
+    def bench_asgi(self, threads=8, repeat=1000, concurrency=None,
+                   **options):
+        """Синхронные потоки против асинхронных представлений.
+
+        Обеим схемам достаётся одинаково памяти: threads потоков, у
+        каждого своё соединение с базой. Синхронная обслуживает threads
+        запросов одновременно, асинхронная держит в цикле событий
+        concurrency запросов и отдаёт обращения к базе пулу из тех же
+        threads потоков. Перед замером ответы сверяются побайтно.
+        """
+        repeat = min(repeat, 500)
+        concurrency = concurrency or threads * 4
+        user, token = self.benchmark_user()
+        recipe = Recipe.objects.order_by('-favorites_count').first()
+        endpoints = {
+            'recipes': '/api/recipes/',
+            'recipes is_favorited': '/api/recipes/?is_favorited=1',
+            'recipe': f'/api/recipes/{recipe.id}/',
+            'subscriptions': '/api/users/subscriptions/',
+            'tags': '/api/tags/',
+        }
+        sync_urls = (path('api/', include('api.urls')),)
+        async_urls = (path('api/', include('api.async_urls')),)
+        with override_settings(
+            ASYNC_DB_WORKERS=threads,
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+        ), ThreadPoolExecutor(max_workers=threads) as executor:
+            for name, url in endpoints.items():
+                with override_settings(ROOT_URLCONF=sync_urls):
+                    expected = Client(
+                        raise_request_exception=False
+                    ).get(url, HTTP_AUTHORIZATION=f'Token {token.key}')
+                    self.fetch(url, token)
+                    started = time.perf_counter()
+                    timings = [duration for _, duration in executor.map(
+                        lambda _: self.fetch(url, token), range(repeat)
+                    )]
+                    sync_elapsed = time.perf_counter() - started
+                with override_settings(ROOT_URLCONF=async_urls):
+                    response, async_timings, async_elapsed = asyncio.run(
+                        self.load_async(url, token, repeat, concurrency)
+                    )
+                if (response.status_code != expected.status_code
+                        or response.content != expected.content):
+                    raise CommandError(f'{name}: ответы асинхронного '
+                                       f'представления отличаются.')
+                self.stdout.write(
+                    f'{name}: синхронно {repeat / sync_elapsed:.1f} RPS, '
+                    f'p50 {percentile(timings, 50) * 1000:.3f} мс, '
+                    f'p99 {percentile(timings, 99) * 1000:.3f} мс; '
+                    f'асинхронно {repeat / async_elapsed:.1f} RPS, '
+                    f'p50 {percentile(async_timings, 50) * 1000:.3f} мс, '
+                    f'p99 {percentile(async_timings, 99) * 1000:.3f} мс'
+                )
+        if async_views.executor is not None:
+            async_views.executor.shutdown()
+            async_views.executor = None
+        self.stdout.write(
+            f'Потоков с соединениями: {threads} в обеих схемах, '
+            f'одновременных запросов: {threads} и {concurrency}.'
+        )
+
+    async def load_async(self, url, token, repeat, concurrency):
+        """Пример ответа, времена ответов и общее время."""
+        client = AsyncClient(raise_request_exception=False)
+        headers = {'authorization': f'Token {token.key}'}
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch():
+            async with semaphore:
+                started = time.perf_counter()
+                await client.get(url, **headers)
+                return time.perf_counter() - started
+
+        response = await client.get(url, **headers)
+        started = time.perf_counter()
+        timings = await asyncio.gather(*(fetch() for _ in range(repeat)))
+        return response, timings, time.perf_counter() - started
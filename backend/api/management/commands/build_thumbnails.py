@@ -0,0 +1,18 @@
+from api.images import build_thumbnails
+from django.core.management.base import BaseCommand
+from foodgram.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные картинки рецептов, у которых их ещё нет.'
+
+    def handle(self, *args, **options):
+        built = 0
+        recipe_ids = Recipe.objects.exclude(image='').values_list(
+            'id', flat=True
+        )
+        for recipe_id in recipe_ids.iterator():
+            built += build_thumbnails(recipe_id)
+        self.stdout.write(self.style.SUCCESS(
+            f'Построены картинки для рецептов: {built}.'
+        ))
@@ -0,0 +1,229 @@
+"""Счётчики запросов к API в формате Prometheus.
+
+Метрики копятся в памяти процесса: при нескольких воркерах каждый
+отдаёт на /metrics свои значения, суммирует их Prometheus.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import connections
+from django.http import HttpResponse
+
+from .cache import cache_stats
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+HISTOGRAMS = (
+    ('request_duration_seconds', 'total', LATENCY_BUCKETS,
+     'Время обработки запроса.'),
+    ('db_duration_seconds', 'db', LATENCY_BUCKETS,
+     'Время выполнения SQL-запросов.'),
+    ('render_duration_seconds', 'render', LATENCY_BUCKETS,
+     'Время рендеринга ответа.'),
+    ('db_queries', 'queries', QUERY_BUCKETS,
+     'Число SQL-запросов на HTTP-запрос.'),
+)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Registry:
+    """Гистограммы по паре (представление, метод)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = defaultdict(dict)
+        self.over_budget = defaultdict(int)
+
+    def observe(self, labels, timings, over_budget):
+        with self.lock:
+            histograms = self.histograms[labels]
+            for name, key, buckets, _ in HISTOGRAMS:
+                if name not in histograms:
+                    histograms[name] = Histogram(buckets)
+                histograms[name].observe(timings[key])
+            if over_budget:
+                self.over_budget[labels] += 1
+
+    def expose(self):
+        lines = []
+        with self.lock:
+            for name, _, _, description in HISTOGRAMS:
+                lines.append(f'# HELP foodgram_{name} {description}')
+                lines.append(f'# TYPE foodgram_{name} histogram')
+                for (view, method), histograms in sorted(
+                        self.histograms.items()):
+                    histogram = histograms[name]
+                    labels = f'view="{view}",method="{method}"'
+                    for bound, count in zip(histogram.buckets,
+                                            histogram.counts):
+                        lines.append(f'foodgram_{name}_bucket'
+                                     f'{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'foodgram_{name}_bucket'
+                                 f'{{{labels},le="+Inf"}} {histogram.count}')
+                    lines.append(f'foodgram_{name}_sum{{{labels}}} '
+                                 f'{histogram.sum}')
+                    lines.append(f'foodgram_{name}_count{{{labels}}} '
+                                 f'{histogram.count}')
+            lines.append('# HELP foodgram_query_budget_exceeded_total '
+                         'Запросы, превысившие QUERY_BUDGET.')
+            lines.append('# TYPE foodgram_query_budget_exceeded_total '
+                         'counter')
+            for (view, method), count in sorted(self.over_budget.items()):
+                lines.append('foodgram_query_budget_exceeded_total'
+                             f'{{view="{view}",method="{method}"}} {count}')
+        lines.append('# HELP foodgram_cache_events_total '
+                     'Попадания и промахи кэша ответов.')
+        lines.append('# TYPE foodgram_cache_events_total counter')
+        for event, count in sorted(cache_stats.items()):
+            lines.append(f'foodgram_cache_events_total{{event="{event}"}} '
+                         f'{count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+current_timings = ContextVar('current_timings', default=None)
+
+
+class RequestTimings:
+    """Число и время SQL-запросов в рамках одного HTTP-запроса.
+
+    Асинхронные представления выполняют запросы параллельно в разных
+    потоках, поэтому время в базе - сумма по всем запросам.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0
+        self.render_started = None
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.db += elapsed
+                self.queries += 1
+
+
+@contextmanager
+def track_queries(timings):
+    """Учёт запросов ко всем базам из текущего потока."""
+    with ExitStack() as stack:
+        if timings is not None:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timings))
+        yield
+
+
+class MetricsMiddleware:
+    """Сбор времени ответа, времени и числа SQL-запросов по представлениям.
+
+    Результат попадает в гистограммы для /metrics и в заголовок
+    Server-Timing. Запросы, сделавшие больше QUERY_BUDGET обращений
+    к базе, пишутся в лог с предупреждением. Работает и в синхронной,
+    и в асинхронной цепочке: в асинхронной запросы из пула потоков
+    учитываются через current_timings.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        request.timings = timings
+        started = time.perf_counter()
+        token = current_timings.set(timings)
+        try:
+            with track_queries(timings):
+                response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings, started)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        request.timings = timings
+        started = time.perf_counter()
+        token = current_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.finish(request, response, timings, started)
+
+    def finish(self, request, response, timings, started):
+        total = time.perf_counter() - started
+        render = (time.perf_counter() - timings.render_started
+                  if timings.render_started is not None else 0)
+        match = request.resolver_match
+        labels = (match.view_name if match else 'unknown', request.method)
+        over_budget = timings.queries > settings.QUERY_BUDGET
+        if over_budget:
+            logger.warning(
+                '%s %s (%s): %s SQL-запросов при бюджете %s',
+                request.method, request.get_full_path(), labels[0],
+                timings.queries, settings.QUERY_BUDGET,
+            )
+        registry.observe(labels, {
+            'total': total, 'db': timings.db, 'render': render,
+            'queries': timings.queries,
+        }, over_budget)
+        response['Server-Timing'] = ', '.join((
+            f'db;dur={timings.db * 1000:.1f};desc="{timings.queries} queries"',
+            f'render;dur={render * 1000:.1f}',
+            f'app;dur={max(total - timings.db - render, 0) * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ))
+        return response
+
+    def process_template_response(self, request, response):
+        request.timings.render_started = time.perf_counter()
+        return response
+
+
+def metrics(request):
+    """Метрики в текстовом формате Prometheus.
+
+    Доступны с адресов из METRICS_ALLOWED_IPS.
+    """
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        raise PermissionDenied
+    return HttpResponse(registry.expose(),
+                        content_type='text/plain; version=0.0.4')
@@ -0,0 +1,26 @@
+from django.db import models
+
+
+class Generation(models.Model):
+    """Поколение данных пространства имён кэша.
+
+    Хранится в базе, если кэш Django не общий для процессов: иначе
+    смена поколения в одном процессе не видна остальным.
+    """
+
+    namespace = models.CharField(
+        'Пространство имён',
+        max_length=100,
+        primary_key=True,
+    )
+
+    value = models.BigIntegerField(
+        'Поколение',
+    )
+
+    class Meta:
+        verbose_name = 'Поколение кэша'
+        verbose_name_plural = 'Поколения кэша'
+
+    def __str__(self):
+        return f'{self.namespace}: {self.value}'
@@ -1,5 +1,140 @@
-from rest_framework.pagination import PageNumberPagination
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, CursorPagination,
+                                       PageNumberPagination)
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор, не считающий строки большой таблицы без фильтров.
+
+    Для запроса без условий в PostgreSQL берётся оценка планировщика
+    из pg_class. Если таблица меньше COUNT_ESTIMATE_THRESHOLD строк или
+    запрос отфильтрован, выполняется обычный COUNT(*).
+    """
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            connection = connections[self.object_list.db]
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'SELECT reltuples FROM pg_class WHERE relname = %s',
+                        [self.object_list.model._meta.db_table],
+                    )
+                    row = cursor.fetchone()
+                if row and row[0] >= settings.COUNT_ESTIMATE_THRESHOLD:
+                    return int(row[0])
+        return super().count
+
+
+class LimitCursorPagination(CursorPagination):
+    page_size_query_param = 'limit'
+
+    def get_ordering(self, request, queryset, view):
+        return self.ordering
 
 
 class PageNumberLimitPagination(PageNumberPagination):
+    """Постраничная пагинация с переходом на курсоры по запросу.
+
+    Если задан cursor_ordering, параметр ?cursor= (можно пустой для
+    первой страницы) включает пагинацию по ключу сортировки без OFFSET
+    и без подсчёта строк.
+    """
+
     page_size_query_param = 'limit'
+    django_paginator_class = EstimatedCountPaginator
+    cursor_ordering = None
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (self.cursor_ordering
+                and LimitCursorPagination.cursor_query_param
+                in request.query_params):
+            self.cursor_paginator = LimitCursorPagination()
+            self.cursor_paginator.ordering = self.cursor_ordering
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class RecipePagination(PageNumberLimitPagination):
+    cursor_ordering = ('-pub_date', '-id')
+
+
+class SubscriptionPagination(PageNumberLimitPagination):
+    cursor_ordering = ('-subscription_id',)
+
+
+class FeedPagination(BasePagination):
+    """Пагинация по ключу (pub_date, id) для страниц, собранных вручную.
+
+    Вместо queryset передаётся функция fetch(limit, before), которая
+    возвращает ключи рецептов по убыванию, начиная после before.
+    """
+
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_keys(self, fetch, request):
+        self.request = request
+        page_size = self.get_page_size(request)
+        keys = fetch(page_size + 1, self.decode_cursor(request))
+        self.next_key = (keys[page_size - 1] if len(keys) > page_size
+                         else None)
+        return keys[:page_size]
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return api_settings.PAGE_SIZE
+        return min(max(page_size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            pub_date, recipe_id = urlsafe_b64decode(
+                cursor.encode()
+            ).decode().split('|')
+            pub_date = parse_datetime(pub_date)
+            recipe_id = int(recipe_id)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if pub_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return pub_date, recipe_id
+
+    def get_next_link(self):
+        if self.next_key is None:
+            return None
+        pub_date, recipe_id = self.next_key
+        cursor = urlsafe_b64encode(
+            f'{pub_date.isoformat()}|{recipe_id}'.encode()
+        ).decode()
+        return replace_query_param(self.request.build_absolute_uri(),
+                                   self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
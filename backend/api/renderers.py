@@ -0,0 +1,63 @@
+import orjson
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer на orjson, вывод побайтно совпадает со стандартным.
+
+    Ответ с отступами или с типами, которых orjson не знает, рендерит
+    JSONRenderer. Очень большие и очень маленькие числа с плавающей
+    точкой orjson пишет иначе, чем json (1e16 вместо 1e+16, 0.00001
+    вместо 1e-05), поэтому такие поля сериализаторы округляют
+    (RoundedFloatField), а рендерер числа не проверяет.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (data is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type,
+                                   renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default,
+                               option=orjson.OPT_PASSTHROUGH_DATETIME)
+        except TypeError:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(
+            b'\xe2\x80\xa9', b'\\u2029'
+        )
+
+
+class FileRenderer(BaseRenderer):
+    """Рендерер для выгрузки файлов.
+
+    Тело файла формирует само представление, рендерер нужен для выбора
+    формата по параметру ?format= или заголовку Accept и для вывода
+    сообщений об ошибках.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, bytes):
+            return data
+        if isinstance(data, dict) and 'detail' in data:
+            data = data['detail']
+        return str(data).encode('utf-8')
+
+
+class PlainTextRenderer(FileRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CSVRenderer(FileRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class PDFRenderer(FileRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
@@ -1,14 +1,65 @@
+import orjson
 from django.contrib.auth import get_user_model
+from django.db import router, transaction
+from django.db.models import F, Manager, Prefetch, prefetch_related_objects
+from django.db.models.deletion import Collector
 from django.shortcuts import get_object_or_404
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_base64.fields import Base64ImageField
 from foodgram.models import (Favorites, Ingredient, IngredientForRecipe,
-                             Recipe, ShoppingCart, Subscriptions, Tag)
+                             Recipe, ShoppingCart, ShoppingListItem,
+                             Subscriptions, Tag, TimelineEntry)
 from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+from .cache import unmark_in_transaction
+from .images import thumbnail_urls
+from .indexes import pantry_index
+from .viewer import forget_viewer, viewer_context
 
 User = get_user_model()
 
 
+def image_url(image, request=None):
+    """Ссылка на картинку, как её отдаёт ImageField."""
+    if not image:
+        return None
+    url = image.url
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def absolute_urls(urls, request):
+    """Ссылки снимка рецепта в том виде, как их отдаёт текущий запрос."""
+    if request is None:
+        return urls
+    return {
+        size: {extension: request.build_absolute_uri(url)
+               for extension, url in formats.items()}
+        for size, formats in urls.items()
+    }
+
+
+def snapshot_lookups():
+    """Связанные объекты, из которых собирается снимок рецепта."""
+    return (
+        'author',
+        'tags',
+        Prefetch('recipes',
+                 queryset=IngredientForRecipe.objects.select_related(
+                     'ingredient'
+                 ).order_by('id')),
+    )
+
+
+def already_exists(message):
+    """Ошибка повторного добавления в том же виде, что из validate()."""
+    return serializers.ValidationError(
+        {api_settings.NON_FIELD_ERRORS_KEY: [message]}
+    )
+
+
 class UserSerializer(UserSerializer):
     """Сериализатор для получения инфо о пользователях."""
 
@@ -20,10 +71,21 @@ class UserSerializer(UserSerializer):
                   'first_name', 'last_name', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return Subscriptions.objects.filter(user=user, author=obj).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return obj.id in viewer_context(
+            self.context.get('request')
+        ).subscriptions
+
+    def to_representation(self, instance):
+        return {
+            'email': instance.email,
+            'id': instance.id,
+            'username': instance.username,
+            'first_name': instance.first_name,
+            'last_name': instance.last_name,
+            'is_subscribed': self.get_is_subscribed(instance),
+        }
 
 
 class UserCreateSerializer(UserCreateSerializer):
@@ -39,10 +101,24 @@ class RecipeShortSerializer(serializers.ModelSerializer):
     """Сериализатор для краткой информации о рецепте."""
 
     image = Base64ImageField()
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'thumbnails', 'cooking_time')
+
+    def get_thumbnails(self, obj):
+        return thumbnail_urls(obj, self.context.get('request'))
+
+    def to_representation(self, instance):
+        request = self.context.get('request')
+        return {
+            'id': instance.id,
+            'name': instance.name,
+            'image': image_url(instance.image, request),
+            'thumbnails': thumbnail_urls(instance, request),
+            'cooking_time': instance.cooking_time,
+        }
 
 
 class SubscriptionSerializer(serializers.ModelSerializer):
@@ -58,47 +134,68 @@ class SubscriptionSerializer(serializers.ModelSerializer):
                   'last_name', 'is_subscribed', 'recipes', 'recipes_count')
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        user = self.context['request'].user
-        if not request or not user.is_authenticated:
-            return False
-        return obj.subscribing.filter(user=user).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return obj.id in viewer_context(
+            self.context.get('request')
+        ).subscriptions
 
     def get_recipes(self, obj):
         request = self.context.get('request')
-        recipes_limit = None
-        if request:
-            recipes_limit = request.query_params.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if recipes_limit:
-            recipes = obj.recipes.all()[:int(recipes_limit)]
+        if hasattr(obj, 'latest_recipes'):
+            recipes = obj.latest_recipes
+        else:
+            recipes_limit = None
+            if request:
+                recipes_limit = request.query_params.get('recipes_limit')
+            recipes = obj.recipes.all()
+            if recipes_limit:
+                recipes = obj.recipes.all()[:int(recipes_limit)]
         return RecipeShortSerializer(recipes, many=True,
                                      context={'request': request}).data
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.recipes.count()
 
+    def to_representation(self, instance):
+        return {
+            'email': instance.email,
+            'id': instance.id,
+            'username': instance.username,
+            'first_name': instance.first_name,
+            'last_name': instance.last_name,
+            'is_subscribed': self.get_is_subscribed(instance),
+            'recipes': self.get_recipes(instance),
+            'recipes_count': self.get_recipes_count(instance),
+        }
+
 
 class UserSubscribeSerializer(serializers.Serializer):
     """Сериализатор для подписки/отписки от пользователей."""
 
     def validate(self, data):
         user = self.context.get('request').user
-        author = get_object_or_404(User, pk=self.context['pk'])
-        if user == author:
+        if str(user.pk) == str(self.context['pk']):
             raise serializers.ValidationError(
                 'Невозможно подписаться на самого себя.'
             )
-        if Subscriptions.objects.filter(user=user, author=author).exists():
-            raise serializers.ValidationError(
-                'Вы уже подписаны на этого пользователя.'
-            )
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         user = self.context.get('request').user
-        author = get_object_or_404(User, pk=validated_data['pk'])
-        Subscriptions.objects.create(user=user, author=author)
+        if not Subscriptions.objects.add(user.id, validated_data['pk']):
+            get_object_or_404(User, pk=validated_data['pk'])
+            raise already_exists('Вы уже подписаны на этого пользователя.')
+        author = User.objects.get(pk=validated_data['pk'])
+        User.objects.filter(pk=author.pk).update(
+            subscribers_count=F('subscribers_count') + 1
+        )
+        TimelineEntry.objects.add_author(user.id, author.id)
+        forget_viewer(user.id)
+        author.is_subscribed = True
         serializer = SubscriptionSerializer(
             author, context={'request': self.context.get('request')}
         )
@@ -113,6 +210,14 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('id', 'name',
                   'color', 'slug')
 
+    def to_representation(self, instance):
+        return {
+            'id': instance.id,
+            'name': instance.name,
+            'color': instance.color,
+            'slug': instance.slug,
+        }
+
 
 class IngredientSerializer(serializers.ModelSerializer):
     """Сериализотор для получения списка ингредиентов."""
@@ -140,9 +245,43 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
                   'measurement_unit',
                   'amount')
 
+    def to_representation(self, instance):
+        return {
+            'id': instance.ingredient.id,
+            'name': instance.ingredient.name,
+            'measurement_unit': instance.ingredient.measurement_unit,
+            'amount': instance.amount,
+        }
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """Список рецептов: недостающие снимки собираются на всю страницу."""
+
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, Manager) else data)
+        self.child.fill_snapshots(recipes)
+        return [self.child.to_representation(recipe) for recipe in recipes]
+
 
 class RecipeSerializer(serializers.ModelSerializer):
-    """Сериализатор для получения информации о рецепте."""
+    """Сериализатор для получения информации о рецепте.
+
+    Поля описывают схему ответа, а сам ответ собирается словарями без
+    обхода полей DRF: на странице рецептов это основная часть времени
+    процессора. Словари повторяют вывод полей ключ в ключ, вложенные
+    сериализаторы делают так же.
+
+    Теги, автор, ингредиенты и ссылки на картинки одинаковы для всех
+    пользователей и берутся из снимка рецепта (Recipe.snapshot, JSON).
+    Снимок сбрасывается сигналами при изменении рецепта, его тегов,
+    ингредиентов и автора и собирается заново при первом чтении.
+    Счётчики из строки рецепта и отметки пользователя из ViewerContext
+    добавляются к снимку при ответе. Анонимным пользователям счётчики
+    не отдаются: их ответы кэшируются по поколению 'recipes', которое
+    добавление в избранное и корзину не меняет.
+    """
+
+    counter_fields = ('favorites_count', 'shopping_cart_count')
 
     tags = TagSerializer(many=True, read_only=True)
     author = UserSerializer(read_only=True)
@@ -150,26 +289,146 @@ class RecipeSerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = Base64ImageField()
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image',
-                  'text', 'cooking_time')
+                  'is_in_shopping_cart', 'name', 'image', 'thumbnails',
+                  'text', 'cooking_time', 'favorites_count',
+                  'shopping_cart_count')
+        list_serializer_class = RecipeListSerializer
 
-    def get_is_favorited(self, obj):
+    def shows_counters(self):
         request = self.context.get('request')
-        return (request and request.user.is_authenticated
-                and Favorites.objects.filter(
-                    user=request.user, recipe=obj
-                ).exists())
+        return request is None or not request.user.is_anonymous
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self.shows_counters():
+            for name in self.counter_fields:
+                del fields[name]
+        return fields
+
+    def get_thumbnails(self, obj):
+        return thumbnail_urls(obj, self.context.get('request'))
+
+    def get_is_favorited(self, obj):
+        return obj.id in viewer_context(self.context.get('request')).favorites
 
     def get_is_in_shopping_cart(self, obj):
+        return obj.id in viewer_context(self.context.get('request')).cart
+
+    def get_author_is_subscribed(self, obj):
+        return obj.author_id in viewer_context(
+            self.context.get('request')
+        ).subscriptions
+
+    def get_snapshot(self, instance):
+        """Общая для всех пользователей часть ответа со ссылками от корня."""
+        author = instance.author
+        return {
+            'tags': self.fields['tags'].to_representation(instance.tags),
+            'author': {
+                'email': author.email,
+                'id': author.id,
+                'username': author.username,
+                'first_name': author.first_name,
+                'last_name': author.last_name,
+            },
+            'ingredients': self.fields['ingredients'].to_representation(
+                instance.recipes
+            ),
+            'image': image_url(instance.image),
+            'thumbnails': thumbnail_urls(instance),
+        }
+
+    def fill_snapshots(self, recipes):
+        """Сборка и запись сброшенных снимков.
+
+        Связанные объекты загружаются только для рецептов без снимка.
+        Снимок записывается, лишь если версия не изменилась с момента
+        чтения рецепта. Снимок, собранный внутри транзакции, снимает
+        отметку сброса, чтобы следующее изменение рецепта в ней снова
+        сбросило снимок. Ответ на запись рецепта (store_snapshots
+        в контексте - False) снимок не записывает: это сделает первое
+        чтение.
+        """
+        stale = [recipe for recipe in recipes if recipe.snapshot is None]
+        if not stale:
+            return
+        prefetch_related_objects(stale, *snapshot_lookups())
+        for recipe in stale:
+            recipe.snapshot = orjson.dumps(self.get_snapshot(recipe)).decode()
+            if not self.context.get('store_snapshots', True):
+                continue
+            unmark_in_transaction(('snapshot', recipe.pk))
+            Recipe.objects.filter(
+                pk=recipe.pk, snapshot_version=recipe.snapshot_version
+            ).update(snapshot=recipe.snapshot)
+
+    def to_representation(self, instance):
         request = self.context.get('request')
-        return (request and request.user.is_authenticated
-                and ShoppingCart.objects.filter(
-                    user=request.user, recipe=obj
-                ).exists())
+        if instance.snapshot is None:
+            self.fill_snapshots([instance])
+        snapshot = orjson.loads(instance.snapshot)
+        author = snapshot['author']
+        author['is_subscribed'] = self.get_author_is_subscribed(instance)
+        image = snapshot['image']
+        if image is not None and request is not None:
+            image = request.build_absolute_uri(image)
+        data = {
+            'id': instance.id,
+            'tags': snapshot['tags'],
+            'author': author,
+            'ingredients': snapshot['ingredients'],
+            'is_favorited': self.get_is_favorited(instance),
+            'is_in_shopping_cart': self.get_is_in_shopping_cart(instance),
+            'name': instance.name,
+            'image': image,
+            'thumbnails': absolute_urls(snapshot['thumbnails'], request),
+            'text': instance.text,
+            'cooking_time': instance.cooking_time,
+        }
+        if self.shows_counters():
+            data['favorites_count'] = instance.favorites_count
+            data['shopping_cart_count'] = instance.shopping_cart_count
+        return data
+
+
+class RoundedFloatField(serializers.FloatField):
+    """Число с плавающей точкой, округлённое до places знаков.
+
+    Округлённое число меньше 1e16 либо равно нулю, либо не меньше
+    10 ** -places, поэтому orjson и json пишут его одинаково,
+    без экспоненты.
+    """
+
+    def __init__(self, places=4, **kwargs):
+        self.places = places
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return round(float(value), self.places)
+
+
+class PantryRecipeSerializer(RecipeSerializer):
+    """Рецепт в подборе по имеющимся ингредиентам."""
+
+    coverage = RoundedFloatField(read_only=True)
+    missing_ingredients = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RecipeSerializer.Meta.fields + ('coverage',
+                                                 'missing_ingredients')
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data['coverage'] = self.fields['coverage'].to_representation(
+            instance.coverage
+        )
+        data['missing_ingredients'] = int(instance.missing_ingredients)
+        return data
 
 
 class IngredientAddSerializer(serializers.ModelSerializer):
@@ -199,8 +458,21 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                   'name', 'text',
                   'cooking_time', 'author')
 
+    def validate_ingredients(self, value):
+        ids = [ingredient['id'] for ingredient in value]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Ингредиенты не должны повторяться.'
+            )
+        missing = set(ids) - Ingredient.objects.in_bulk(ids).keys()
+        if missing:
+            raise serializers.ValidationError(
+                f'Нет ингредиентов с id {sorted(missing)}.'
+            )
+        return value
+
     def add_ingredients_and_tags(self, tags, ingredients, recipe):
-        recipe.tags.set(tags)
+        recipe.tags.add(*tags)
         ingredients_list = []
         for ingredient in ingredients:
             new_ingredient = IngredientForRecipe(
@@ -212,66 +484,121 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         IngredientForRecipe.objects.bulk_create(ingredients_list)
         return recipe
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
+        TimelineEntry.objects.fan_out(recipe)
         return self.add_ingredients_and_tags(tags, ingredients, recipe)
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.ingredients.clear()
-        ingredients = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
         instance = super().update(instance, validated_data)
-        return self.add_ingredients_and_tags(
-            tags, ingredients, instance
-        )
+        if tags is not None:
+            instance.tags.set(tags)
+        if ingredients is not None:
+            self.update_ingredients(instance, ingredients)
+        return instance
+
+    def update_ingredients(self, recipe, ingredients):
+        """Изменение ингредиентов рецепта по разнице с текущими.
+
+        Удаляются, обновляются и добавляются только изменившиеся
+        строки, итоги списков покупок меняются на ту же разницу.
+        Удаляются уже прочитанные строки, без повторного чтения
+        перед DELETE.
+        """
+        current = {
+            item.ingredient_id: item
+            for item in IngredientForRecipe.objects.filter(recipe=recipe)
+        }
+        amounts = {item['id']: item['amount'] for item in ingredients}
+        deltas = {}
+        removed = current.keys() - amounts.keys()
+        if removed:
+            collector = Collector(using=router.db_for_write(
+                IngredientForRecipe
+            ))
+            collector.collect([current[ingredient_id]
+                               for ingredient_id in removed])
+            collector.delete()
+            deltas.update((ingredient_id, -current[ingredient_id].amount)
+                          for ingredient_id in removed)
+        changed = []
+        created = []
+        for ingredient_id, amount in amounts.items():
+            item = current.get(ingredient_id)
+            if item is None:
+                created.append(IngredientForRecipe(
+                    recipe=recipe, ingredient_id=ingredient_id, amount=amount
+                ))
+                deltas[ingredient_id] = amount
+            elif item.amount != amount:
+                deltas[ingredient_id] = amount - item.amount
+                item.amount = amount
+                changed.append(item)
+        if changed:
+            IngredientForRecipe.objects.bulk_update(changed, ('amount',))
+        if created:
+            IngredientForRecipe.objects.bulk_create(created)
+            pantry_index.schedule_update(recipe.id)
+        if deltas:
+            ShoppingListItem.objects.add_amounts(recipe.id, deltas)
 
     def to_representation(self, instance):
         request = self.context.get('request')
         return RecipeSerializer(
             instance,
-            context={'request': request}
+            context={'request': request, 'store_snapshots': False}
         ).data
 
 
 class FavoriteSerializer(serializers.Serializer):
 
-    def validate(self, data):
-        user = self.context['request'].user
-        pk = self.context['recipe_id']
-
-        if Favorites.objects.filter(user=user,
-                                    recipe__id=pk).exists():
-            raise serializers.ValidationError(
-                'Рецепт уже добавлен в избранное.'
-            )
-        return data
-
+    @transaction.atomic
     def create(self, validated_data):
-        recipe = get_object_or_404(Recipe, pk=validated_data['id'])
         user = self.context['request'].user
-        Favorites.objects.create(user=user, recipe=recipe)
+        if not Favorites.objects.add(user.id, validated_data['id']):
+            get_object_or_404(Recipe, pk=validated_data['id'])
+            raise already_exists('Рецепт уже добавлен в избранное.')
+        Recipe.objects.filter(pk=validated_data['id']).update(
+            favorites_count=F('favorites_count') + 1
+        )
+        recipe = Recipe.objects.get(pk=validated_data['id'])
+        forget_viewer(user.id)
         serializer = RecipeShortSerializer(recipe)
         return serializer.data
 
 
 class ShoppingCartSerializer(serializers.Serializer):
 
-    def validate(self, data):
-        user = self.context['request'].user
-        pk = self.context['recipe_id']
-
-        if ShoppingCart.objects.filter(user=user,
-                                       recipe__id=pk).exists():
-            raise serializers.ValidationError(
-                'Рецепт уже добавлен в список покупок.'
-            )
-        return data
-
+    @transaction.atomic
     def create(self, validated_data):
-        recipe = get_object_or_404(Recipe, pk=validated_data['id'])
         user = self.context['request'].user
-        ShoppingCart.objects.create(user=user, recipe=recipe)
+        if not ShoppingCart.objects.add(user.id, validated_data['id']):
+            get_object_or_404(Recipe, pk=validated_data['id'])
+            raise already_exists('Рецепт уже добавлен в список покупок.')
+        Recipe.objects.filter(pk=validated_data['id']).update(
+            shopping_cart_count=F('shopping_cart_count') + 1
+        )
+        recipe = Recipe.objects.get(pk=validated_data['id'])
+        ShoppingListItem.objects.add_recipe(recipe.id, user_id=user.id)
+        forget_viewer(user.id)
         serializer = RecipeShortSerializer(recipe)
         return serializer.data
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетных операций."""
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
@@ -0,0 +1,90 @@
+import csv
+import io
+import os
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+TITLE = 'Список покупок:'
+CSV_HEADER = ('Ингредиент', 'Единица измерения', 'Количество')
+PDF_FONT = 'ShoppingListFont'
+PDF_FONT_SIZE = 12
+PDF_LINE_HEIGHT = 18
+PDF_MARGIN = 50
+PDF_CHUNK_SIZE = 64 * 1024
+
+
+class Echo:
+    """Буфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def as_txt(items):
+    """Список покупок в текстовом виде."""
+    yield f'{TITLE}\n'
+    for item in items:
+        yield (f"\n{item['ingredient__name']} "
+               f"({item['ingredient__measurement_unit']}) - "
+               f"{item['amount']}")
+
+
+def as_csv(items):
+    """Список покупок в формате CSV."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for item in items:
+        yield writer.writerow((item['ingredient__name'],
+                               item['ingredient__measurement_unit'],
+                               item['amount']))
+
+
+def get_pdf_font():
+    """Шрифт с кириллицей, при его отсутствии - встроенный Helvetica."""
+    if PDF_FONT in pdfmetrics.getRegisteredFontNames():
+        return PDF_FONT
+    if not os.path.exists(settings.SHOPPING_LIST_PDF_FONT):
+        return 'Helvetica'
+    pdfmetrics.registerFont(TTFont(PDF_FONT,
+                                   settings.SHOPPING_LIST_PDF_FONT))
+    return PDF_FONT
+
+
+def as_pdf(items):
+    """Список покупок в формате PDF.
+
+    Таблица ссылок PDF пишется в конец документа, поэтому файл
+    отдаётся после обхода всех строк, но сами строки из базы
+    не накапливаются в памяти.
+    """
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    font = get_pdf_font()
+    width, height = A4
+    y = height - PDF_MARGIN
+    pdf.setFont(font, PDF_FONT_SIZE)
+    pdf.drawString(PDF_MARGIN, y, TITLE)
+    for item in items:
+        y -= PDF_LINE_HEIGHT
+        if y < PDF_MARGIN:
+            pdf.showPage()
+            pdf.setFont(font, PDF_FONT_SIZE)
+            y = height - PDF_MARGIN
+        pdf.drawString(PDF_MARGIN, y,
+                       f"{item['ingredient__name']} "
+                       f"({item['ingredient__measurement_unit']}) - "
+                       f"{item['amount']}")
+    pdf.save()
+    buffer.seek(0)
+    yield from iter(lambda: buffer.read(PDF_CHUNK_SIZE), b'')
+
+
+EXPORTERS = {
+    'txt': as_txt,
+    'csv': as_csv,
+    'pdf': as_pdf,
+}
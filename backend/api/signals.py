@@ -0,0 +1,244 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from foodgram.models import (Favorites, Ingredient, IngredientForRecipe,
+                             Recipe, ShoppingCart, ShoppingListItem,
+                             Subscriptions, Tag, User)
+from foodgram.search import index_recipe, unindex_recipe
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
+from .cache import bump_generation_on_commit, mark_in_transaction
+from .images import schedule_thumbnails
+from .indexes import pantry_index
+from .viewer import forget_viewer
+
+SNAPSHOT_AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+COUNTERS = {
+    Favorites: ('recipe', 'favorites_count'),
+    ShoppingCart: ('recipe', 'shopping_cart_count'),
+    Subscriptions: ('author', 'subscribers_count'),
+    Recipe: ('author', 'recipes_count'),
+}
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredients(sender, **kwargs):
+    bump_generation_on_commit('ingredients')
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags(sender, **kwargs):
+    bump_generation_on_commit('tags')
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver((post_save, post_delete), sender=IngredientForRecipe)
+@receiver((post_save, post_delete), sender=Tag)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipes_cache(sender, action=None, **kwargs):
+    if action not in (None, 'post_add', 'post_remove', 'post_clear'):
+        return
+    bump_generation_on_commit('recipes')
+
+
+@receiver(post_save, sender=User)
+def invalidate_recipes_cache_on_user_change(sender, update_fields=None,
+                                            **kwargs):
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    bump_generation_on_commit('recipes')
+
+
+def invalidate_snapshot(recipe_id):
+    """Сброс снимка рецепта, один раз за транзакцию.
+
+    Пока снимок не собран заново (fill_snapshots снимает отметку),
+    повторный сброс ничего не меняет.
+    """
+    if mark_in_transaction(('snapshot', recipe_id)):
+        Recipe.objects.filter(pk=recipe_id).invalidate_snapshots()
+        return True
+    return False
+
+
+def forget_snapshot(recipe):
+    recipe.snapshot = None
+    if invalidate_snapshot(recipe.pk):
+        recipe.snapshot_version += 1
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_recipe_snapshot(sender, instance, created, **kwargs):
+    if created:
+        mark_in_transaction(('snapshot', instance.pk))
+    else:
+        forget_snapshot(instance)
+
+
+@receiver(pre_delete, sender=Recipe)
+def skip_snapshot_of_deleted_recipe(sender, instance, **kwargs):
+    """Снимок удаляемого рецепта не сбрасывается при удалении строк."""
+    mark_in_transaction(('snapshot', instance.pk))
+
+
+@receiver((post_save, post_delete), sender=IngredientForRecipe)
+def invalidate_snapshot_on_ingredients_change(sender, instance, **kwargs):
+    invalidate_snapshot(instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_snapshots_on_tags_change(sender, instance, action, reverse,
+                                        pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        forget_snapshot(instance)
+    elif pk_set:
+        Recipe.objects.filter(pk__in=[
+            recipe_id for recipe_id in pk_set
+            if mark_in_transaction(('snapshot', recipe_id))
+        ]).invalidate_snapshots()
+    else:
+        Recipe.objects.filter(tags=instance).invalidate_snapshots()
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def invalidate_snapshots_on_tag_change(sender, instance, created=False,
+                                       **kwargs):
+    if not created:
+        Recipe.objects.filter(tags=instance).invalidate_snapshots()
+
+
+@receiver(post_save, sender=Ingredient)
+def invalidate_snapshots_on_ingredient_change(sender, instance, created,
+                                              **kwargs):
+    if not created:
+        Recipe.objects.filter(
+            recipes__ingredient=instance
+        ).invalidate_snapshots()
+
+
+@receiver(post_save, sender=User)
+def invalidate_snapshots_on_author_change(sender, instance, created,
+                                          update_fields=None, **kwargs):
+    if created or (update_fields
+                   and not set(update_fields) & SNAPSHOT_AUTHOR_FIELDS):
+        return
+    Recipe.objects.filter(author=instance).invalidate_snapshots()
+
+
+@receiver(post_save, sender=Recipe)
+def build_recipe_thumbnails(sender, instance, **kwargs):
+    if instance.image and (instance.thumbnails.get('source')
+                           != instance.image.name):
+        transaction.on_commit(lambda: schedule_thumbnails(instance.id))
+
+
+@receiver(post_save, sender=Recipe)
+def update_search_index(sender, instance, using, **kwargs):
+    index_recipe(instance, using)
+
+
+@receiver(pre_delete, sender=Recipe)
+def subtract_from_shopping_lists(sender, instance, **kwargs):
+    ShoppingListItem.objects.add_recipe(instance.id, multiplier=-1)
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_from_search_index(sender, instance, using, **kwargs):
+    unindex_recipe(instance, using)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def update_pantry_index(sender, instance, created=True, **kwargs):
+    """Новый и удалённый рецепт в индексе подбора по продуктам.
+
+    Ингредиенты существующего рецепта меняются строками
+    IngredientForRecipe или в RecipeCreateSerializer.update_ingredients.
+    """
+    if created:
+        pantry_index.schedule_update(instance.id)
+
+
+@receiver((post_save, post_delete), sender=IngredientForRecipe)
+def update_pantry_index_on_ingredients_change(sender, instance, **kwargs):
+    pantry_index.schedule_update(instance.recipe_id)
+
+
+def change_counter(sender, target_id, delta):
+    field_name, counter = COUNTERS[sender]
+    field = sender._meta.get_field(field_name)
+    field.related_model.objects.filter(pk=target_id).update(
+        **{counter: F(counter) + delta}
+    )
+
+
+@receiver(post_save, sender=Favorites)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Subscriptions)
+@receiver(post_save, sender=Recipe)
+def count_saved(sender, instance, created, **kwargs):
+    """Счётчик объекта, на который ссылается новая или изменённая строка.
+
+    Запросы API пишут связи в обход ORM и меняют счётчики сами,
+    здесь учитываются админка и прочие сохранения через ORM.
+    """
+    attname = sender._meta.get_field(COUNTERS[sender][0]).attname
+    target_id = getattr(instance, attname)
+    loaded_id = instance._loaded_values.get(attname, target_id)
+    if created:
+        change_counter(sender, target_id, 1)
+    elif loaded_id != target_id:
+        change_counter(sender, loaded_id, -1)
+        change_counter(sender, target_id, 1)
+    instance._loaded_values = {**instance._loaded_values,
+                               attname: target_id}
+
+
+@receiver(post_delete, sender=Favorites)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Subscriptions)
+@receiver(post_delete, sender=Recipe)
+def count_deleted(sender, instance, **kwargs):
+    """Счётчик уменьшается и при каскадном удалении строки."""
+    attname = sender._meta.get_field(COUNTERS[sender][0]).attname
+    change_counter(sender, getattr(instance, attname), -1)
+
+
+@receiver((post_save, post_delete), sender=Favorites)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+@receiver((post_save, post_delete), sender=Subscriptions)
+def forget_viewer_on_relation_change(sender, instance, **kwargs):
+    """Множества пользователя после записи связи через ORM.
+
+    Так меняются связи из админки и при каскадном удалении рецептов
+    и пользователей. Связь, перенесённую на другого пользователя,
+    забывают оба.
+    """
+    forget_viewer(instance.user_id)
+    loaded_id = instance._loaded_values.get('user_id', instance.user_id)
+    if loaded_id != instance.user_id:
+        forget_viewer(loaded_id)
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    transaction.on_commit(lambda: token_cache.delete([instance.key]))
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, created, update_fields=None,
+                       **kwargs):
+    if created or (update_fields and set(update_fields) == {'last_login'}):
+        return
+    keys = list(Token.objects.filter(user=instance)
+                .values_list('key', flat=True))
+    if keys:
+        transaction.on_commit(lambda: token_cache.delete(keys))
@@ -0,0 +1,949 @@
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from io import StringIO
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from threading import Barrier
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import F, Value, prefetch_related_objects
+from django.test import (AsyncClient, Client, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from foodgram.models import (Favorites, Ingredient, IngredientForRecipe,
+                             Recipe, ShoppingCart, ShoppingListItem,
+                             Subscriptions, Tag, TimelineEntry, User)
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+
+from . import async_views
+from .authentication import token_cache
+from .cache import bump_generation, get_generation
+from .filters import RecipeFilter
+from .indexes import PantryIndex
+from .models import Generation
+from .renderers import ORJSONRenderer
+from .serializers import (IngredientRecipeSerializer, PantryRecipeSerializer,
+                          RecipeSerializer, RecipeShortSerializer,
+                          SubscriptionSerializer, TagSerializer,
+                          UserSerializer, snapshot_lookups)
+from .viewer import ViewerContext
+from .views import RecipeViewSet
+
+
+def create_user(number):
+    return User.objects.create_user(
+        email=f'user{number}@test.foodgram', username=f'user{number}',
+        password='password',
+    )
+
+
+def create_recipes(author, count, tags, ingredients, amount=10):
+    recipes = []
+    for number in range(count):
+        recipe = Recipe.objects.create(author=author, name=f'Рецепт {number}',
+                                       text='Описание', cooking_time=10)
+        recipe.tags.set(tags)
+        IngredientForRecipe.objects.bulk_create(
+            IngredientForRecipe(recipe=recipe, ingredient=ingredient,
+                                amount=amount)
+            for ingredient in ingredients
+        )
+        recipes.append(recipe)
+    return recipes
+
+
+class APITestCase(TestCase):
+    """Автор с рецептами и читатель с избранным, корзиной и подпиской."""
+
+    recipes_count = 12
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user(1)
+        cls.author = create_user(2)
+        cls.tags = [Tag.objects.create(name=f'Тег {number}',
+                                       slug=f'tag-{number}', color='#fff')
+                    for number in range(2)]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        cls.recipes = create_recipes(cls.author, cls.recipes_count,
+                                     cls.tags, cls.ingredients)
+        Favorites.objects.create(user=cls.user, recipe=cls.recipes[0])
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.recipes[1])
+        Subscriptions.objects.create(user=cls.user, author=cls.author)
+
+    def setUp(self):
+        # Транзакция класса не фиксируется, и отложенные в setUpTestData
+        # действия вместе с отметками транзакции мешали бы тестам.
+        connection.run_on_commit = []
+        cache.clear()
+        token_cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @contextmanager
+    def committed(self):
+        """Действия после фиксации выполняются и снимаются, как при ней."""
+        start = len(connection.run_on_commit)
+        with self.captureOnCommitCallbacks(execute=True):
+            yield
+        del connection.run_on_commit[start:]
+
+
+class GenerationTest(TestCase):
+
+    def test_bump_is_seen_without_local_cache(self):
+        """Смену поколения видит процесс со своим, пустым кэшем."""
+        generation = get_generation('recipes')
+        self.assertEqual(get_generation('recipes'), generation)
+        bumped = bump_generation('recipes')
+        self.assertGreater(bumped, generation)
+        cache.clear()
+        self.assertEqual(get_generation('recipes'), bumped)
+
+
+class RecipeListQueriesTest(APITestCase):
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        """Страница рецептов: число строк, страница и отметки читателя.
+
+        Первый запрос собирает снимки рецептов, повторный читает их.
+        В PostgreSQL пагинатор сначала смотрит оценку числа строк.
+        """
+        queries = 4 if connection.vendor == 'postgresql' else 3
+        for limit in (2, 10):
+            self.client.get(f'/api/recipes/?limit={limit}')
+            with self.assertNumQueries(queries):
+                response = self.client.get(f'/api/recipes/?limit={limit}')
+            self.assertEqual(len(response.data['results']), limit)
+            recipe = response.data['results'][-1]
+            self.assertEqual(len(recipe['tags']), len(self.tags))
+            self.assertEqual(len(recipe['ingredients']),
+                             len(self.ingredients))
+            self.assertTrue(recipe['author']['is_subscribed'])
+
+
+class SubscriptionsListTest(APITestCase):
+    """Подписки с ограничением числа рецептов."""
+
+    def test_without_subscriptions(self):
+        self.client.force_authenticate(self.author)
+        response = self.client.get('/api/users/subscriptions/',
+                                   {'recipes_limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+
+    def test_page_past_the_end(self):
+        response = self.client.get('/api/users/subscriptions/',
+                                   {'recipes_limit': 2, 'page': 2})
+        self.assertEqual(response.status_code, 404)
+
+    def test_recipes_limit(self):
+        response = self.client.get('/api/users/subscriptions/',
+                                   {'recipes_limit': 2})
+        self.assertEqual(response.status_code, 200)
+        author, = response.data['results']
+        self.assertEqual(len(author['recipes']), 2)
+        self.assertEqual(author['recipes_count'], self.recipes_count)
+
+
+class PantryIndexTest(APITestCase):
+    """Индекс подбора по продуктам в нескольких процессах."""
+
+    def setUp(self):
+        super().setUp()
+        self.index, self.other = PantryIndex(), PantryIndex()
+        for index in (self.index, self.other):
+            index.get_data()
+
+    def matched(self, index):
+        return {recipe_id for recipe_id, *_ in index.match(
+            [self.extra.id]
+        )[:len(self.recipes)]}
+
+    def add_extra(self):
+        self.extra = Ingredient.objects.create(name='Добавка',
+                                               measurement_unit='г')
+        IngredientForRecipe.objects.create(recipe=self.recipes[0],
+                                           ingredient=self.extra, amount=1)
+        self.index.update({self.recipes[0].id})
+
+    def test_unchanged_ingredients_keep_generation(self):
+        generation = get_generation('pantry')
+        self.index.update({recipe.id for recipe in self.recipes})
+        self.assertEqual(get_generation('pantry'), generation)
+
+    def test_local_update_in_place(self):
+        generation = get_generation('pantry')
+        self.add_extra()
+        self.assertGreater(get_generation('pantry'), generation)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.matched(self.index), {self.recipes[0].id})
+
+    def test_other_process_rebuilds_after_max_age(self):
+        self.add_extra()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.matched(self.other), set())
+        with override_settings(PANTRY_INDEX_MAX_AGE=0):
+            self.assertEqual(self.matched(self.other), {self.recipes[0].id})
+
+
+class HotPathIndexesTest(APITestCase):
+    """Отфильтрованная лента рецептов читается по индексам.
+
+    В тестовой базе мало строк, поэтому в PostgreSQL последовательный
+    просмотр запрещается: если подходящего индекса нет, план всё равно
+    его покажет. SQLite выбирает индекс и на малых таблицах.
+    """
+
+    def setUp(self):
+        super().setUp()
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def filtered(self, **params):
+        request = RequestFactory().get('/api/recipes/', params)
+        request.user = self.user
+        return RecipeFilter(
+            request.GET, queryset=Recipe.objects.all(), request=request
+        ).qs.order_by('-pub_date', '-id')[:6]
+
+    def user_indexes(self, model):
+        """Индексы и ограничения уникальности, начинающиеся с user_id."""
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, model._meta.db_table
+            )
+            names = {name for name, info in constraints.items()
+                     if (info['index'] or info['unique'])
+                     and info['columns'][0] == 'user_id'}
+            if connection.vendor == 'sqlite' and names:
+                # Ограничения уникальности SQLite хранит в autoindex,
+                # которых интроспекция не показывает.
+                cursor.execute(
+                    f'PRAGMA index_list({model._meta.db_table})'
+                )
+                for index in [row[1] for row in cursor.fetchall()]:
+                    cursor.execute(f'PRAGMA index_info({index})')
+                    if cursor.fetchone()[2] == 'user_id':
+                        names.add(index)
+        return names
+
+    def assertUsesIndex(self, queryset, names):
+        plan = queryset.explain()
+        self.assertTrue(any(name in plan for name in names),
+                        f'Нет индекса из {sorted(names)}:\n{plan}')
+
+    def test_feed_uses_pub_date_index(self):
+        self.assertUsesIndex(self.filtered(), {'recipe_pub_date_idx'})
+
+    def test_author_filter_uses_author_index(self):
+        self.assertUsesIndex(self.filtered(author=self.author.id),
+                             {'recipe_author_pub_date_idx'})
+
+    def test_favorites_filter_uses_relation_index(self):
+        names = self.user_indexes(Favorites)
+        self.assertIn('unique_favorites', names)
+        self.assertUsesIndex(self.filtered(is_favorited=1), names)
+
+    def test_cart_filter_uses_relation_index(self):
+        names = self.user_indexes(ShoppingCart)
+        self.assertIn('unique_shopping_cart', names)
+        self.assertUsesIndex(self.filtered(is_in_shopping_cart=1), names)
+
+
+class RecipeImageTest(APITestCase):
+
+    def test_same_content_reuses_file(self):
+        """Повторная загрузка тех же байтов не создаёт копию."""
+        with TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root):
+            for recipe in self.recipes[:2]:
+                recipe.image = ContentFile(b'image', name='photo.PNG')
+                recipe.save(update_fields=('image',))
+            first, second = (recipe.image.name
+                             for recipe in self.recipes[:2])
+            self.assertEqual(first, second)
+            self.assertTrue(first.endswith('.png'))
+            self.assertEqual(os.listdir(os.path.join(media_root,
+                                                     'recipes')),
+                             [os.path.basename(first)])
+
+
+class CountersTest(APITestCase):
+    """Счётчики при изменениях через ORM, админку и каскады."""
+
+    def counters(self):
+        return (
+            list(Recipe.objects.filter(pk__in=(
+                self.recipes[0].pk, self.recipes[1].pk
+            )).order_by('pk').values_list('favorites_count',
+                                          'shopping_cart_count')),
+            User.objects.values_list('recipes_count',
+                                     'subscribers_count').get(
+                pk=self.author.pk
+            ),
+        )
+
+    def assertCounters(self, favorites, carts, recipes, subscribers):
+        self.assertEqual(self.counters(), (
+            list(zip(favorites, carts)), (recipes, subscribers)
+        ))
+
+    def test_fixture(self):
+        self.assertCounters((1, 0), (0, 1), self.recipes_count, 1)
+
+    def test_relation_moved(self):
+        favorite = Favorites.objects.get(user=self.user)
+        favorite.recipe = self.recipes[1]
+        favorite.save()
+        favorite.save()
+        self.assertCounters((0, 1), (0, 1), self.recipes_count, 1)
+
+    def test_recipe_deleted(self):
+        self.recipes[0].delete()
+        self.assertEqual(User.objects.get(pk=self.author.pk).recipes_count,
+                         self.recipes_count - 1)
+
+    def test_reader_deleted(self):
+        self.user.delete()
+        self.assertCounters((0, 0), (0, 0), self.recipes_count, 0)
+
+    def test_admin_changes(self):
+        admin = User.objects.create_superuser(
+            email='admin@test.foodgram', username='admin', password='x'
+        )
+        self.client.force_login(admin)
+        favorite = Favorites.objects.get(user=self.user)
+        response = self.client.post(
+            '/admin/foodgram/favorites/',
+            {'action': 'delete_selected', '_selected_action': [favorite.pk],
+             'post': 'yes'},
+        )
+        self.assertEqual(response.status_code, 302)
+        response = self.client.post('/admin/foodgram/subscriptions/add/', {
+            'user': admin.pk, 'author': self.author.pk,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertCounters((0, 0), (0, 1), self.recipes_count, 2)
+
+
+class FeedTest(APITestCase):
+    """Лента нового подписчика."""
+
+    def subscribe(self):
+        reader = create_user(3)
+        self.client.force_authenticate(reader)
+        response = self.client.post(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(response.status_code, 201)
+        return reader
+
+    def assertFeed(self, entries):
+        reader = self.subscribe()
+        self.assertEqual(TimelineEntry.objects.filter(user=reader).count(),
+                         entries)
+        response = self.client.get('/api/recipes/feed/',
+                                   {'limit': self.recipes_count})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), self.recipes_count)
+
+    def test_author_within_fanout_limit(self):
+        self.assertFeed(self.recipes_count)
+
+    @override_settings(FEED_FANOUT_LIMIT=1)
+    def test_author_above_fanout_limit(self):
+        """Рецепты популярного автора не копируются в ленту."""
+        self.assertFeed(0)
+
+
+class TogglesCacheTest(APITestCase):
+    """Добавление в избранное и корзину не сбрасывает кэш рецептов.
+
+    Число запросов включает действия после фиксации транзакции.
+    """
+
+    def toggle(self, method, url, status, queries, data=None):
+        generation = get_generation('recipes')
+        with self.assertNumQueries(queries), self.committed():
+            response = getattr(self.client, method)(url, data,
+                                                    format='json')
+        self.assertEqual(response.status_code, status)
+        self.assertEqual(get_generation('recipes'), generation)
+
+    def test_favorite(self):
+        url = f'/api/recipes/{self.recipes[2].id}/favorite/'
+        self.toggle('post', url, 201, 5)
+        self.toggle('delete', url, 204, 4)
+
+    def test_shopping_cart(self):
+        url = f'/api/recipes/{self.recipes[2].id}/shopping_cart/'
+        self.toggle('post', url, 201, 6)
+        self.toggle('delete', url, 204, 6)
+
+    def test_batches(self):
+        data = {'recipes': [recipe.id for recipe in self.recipes[2:5]]}
+        for url, added, removed in (('/api/recipes/favorite/', 4, 4),
+                                    ('/api/recipes/shopping_cart/', 5, 6)):
+            self.toggle('post', url, 200, added, data)
+            self.toggle('delete', url, 200, removed, data)
+
+    def test_shopping_cart_cleared(self):
+        self.toggle('delete', '/api/recipes/shopping_cart/clear/', 204, 5)
+
+    def test_counters_not_in_anonymous_responses(self):
+        recipe_id = self.recipes[0].id
+        response = self.client.get(f'/api/recipes/{recipe_id}/')
+        self.assertEqual(response.data['favorites_count'], 1)
+        self.client.force_authenticate(None)
+        response = self.client.get(f'/api/recipes/{recipe_id}/')
+        self.assertNotIn('favorites_count', response.data)
+        response = self.client.get('/api/recipes/')
+        self.assertNotIn('shopping_cart_count', response.data['results'][0])
+
+
+class ShoppingListCascadeTest(APITestCase):
+    """Итоги списков покупок при удалении рецептов каскадом."""
+
+    def setUp(self):
+        super().setUp()
+        self.reader = create_user(3)
+        other_author = create_user(4)
+        self.other_recipe, = create_recipes(other_author, 1, self.tags,
+                                            self.ingredients[:1], amount=7)
+        for recipe in (self.recipes[1], self.other_recipe):
+            ShoppingCart.objects.create(user=self.reader, recipe=recipe)
+        ShoppingListItem.objects.rebuild()
+
+    def totals(self, user):
+        return dict(ShoppingListItem.objects.filter(
+            user=user
+        ).values_list('ingredient_id', 'amount'))
+
+    def assertTotalsExpected(self, user):
+        self.assertEqual(self.totals(user), {
+            row['recipe__recipes__ingredient']: row['total']
+            for row in ShoppingListItem.objects.expected(user.id)
+        })
+
+    def test_author_account_deleted(self):
+        self.author.delete()
+        self.assertEqual(self.totals(self.reader),
+                         {self.ingredients[0].id: 7})
+        self.assertEqual(self.totals(self.user), {})
+
+    def test_recipe_deleted_through_api(self):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        response = client.delete(f'/api/recipes/{self.recipes[1].id}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertTotalsExpected(self.reader)
+        self.assertEqual(self.totals(self.user), {})
+
+    def test_recipe_deleted_in_admin(self):
+        admin = User.objects.create_superuser(
+            email='admin@test.foodgram', username='admin', password='x'
+        )
+        self.client.force_login(admin)
+        response = self.client.post(
+            f'/admin/foodgram/recipe/{self.other_recipe.id}/delete/',
+            {'post': 'yes'},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertTotalsExpected(self.reader)
+        self.assertEqual(self.totals(self.reader),
+                         {ingredient.id: 10
+                          for ingredient in self.ingredients})
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'SQLite не допускает одновременной записи.')
+class ConcurrentTogglesTest(TransactionTestCase):
+    """Одновременные одинаковые добавления и удаления связей.
+
+    Ровно один POST создаёт связь и ровно один DELETE её удаляет,
+    остальные получают 400 и 404. Строка и счётчик остаются
+    согласованными.
+    """
+
+    threads = 8
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.user = create_user(1)
+        self.author = create_user(2)
+        self.recipe, = create_recipes(self.author, 1, (), ())
+        self.token = Token.objects.create(user=self.user)
+
+    def request(self, method, url, barrier):
+        client = Client(raise_request_exception=False)
+        barrier.wait()
+        try:
+            return getattr(client, method)(
+                url, HTTP_AUTHORIZATION=f'Token {self.token.key}'
+            ).status_code
+        finally:
+            connection.close()
+
+    def toggle(self, method, url):
+        barrier = Barrier(self.threads)
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            return Counter(executor.map(
+                lambda _: self.request(method, url, barrier),
+                range(self.threads),
+            ))
+
+    def assertToggles(self, url, rows, counter):
+        for method, created, expected in (('post', 201, 1),
+                                          ('delete', 204, 0)):
+            statuses = self.toggle(method, url)
+            self.assertEqual(statuses[created], 1, statuses)
+            self.assertEqual(statuses[created] + statuses[400]
+                             + statuses[404], self.threads, statuses)
+            self.assertEqual(rows.count(), expected)
+            self.assertEqual(counter(), expected)
+
+    def test_favorite(self):
+        self.assertToggles(
+            f'/api/recipes/{self.recipe.id}/favorite/',
+            Favorites.objects.filter(user=self.user, recipe=self.recipe),
+            lambda: Recipe.objects.get(pk=self.recipe.pk).favorites_count,
+        )
+
+    def test_shopping_cart(self):
+        self.assertToggles(
+            f'/api/recipes/{self.recipe.id}/shopping_cart/',
+            ShoppingCart.objects.filter(user=self.user, recipe=self.recipe),
+            lambda: Recipe.objects.get(
+                pk=self.recipe.pk
+            ).shopping_cart_count,
+        )
+
+    def test_subscribe(self):
+        self.assertToggles(
+            f'/api/users/{self.author.id}/subscribe/',
+            Subscriptions.objects.filter(user=self.user, author=self.author),
+            lambda: User.objects.get(pk=self.author.pk).subscribers_count,
+        )
+
+
+class TogglesConflictTest(APITestCase):
+    """Повторные добавления и удаления связей в любой базе.
+
+    Проигравший гонку запрос видит то же, что и здесь: вставка
+    не проходит по ограничению уникальности, удаление не находит
+    строку. Связь не читается перед записью, поэтому окна между
+    проверкой и вставкой нет.
+    """
+
+    def assertConflicts(self, url, table, rows, counter):
+        before = counter()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, 400)
+        statements = [query['sql'] for query in queries]
+        first_write = next(index for index, sql in enumerate(statements)
+                           if sql.startswith('INSERT'))
+        self.assertFalse([sql for sql in statements[:first_write]
+                          if sql.startswith('SELECT') and table in sql])
+        self.assertEqual(rows.count(), 1)
+        self.assertEqual(counter(), before)
+        rows.delete()
+        before = counter()
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(counter(), before)
+
+    def test_favorite(self):
+        recipe = self.recipes[0]
+        self.assertConflicts(
+            f'/api/recipes/{recipe.id}/favorite/',
+            Favorites._meta.db_table,
+            Favorites.objects.filter(user=self.user, recipe=recipe),
+            lambda: Recipe.objects.get(pk=recipe.pk).favorites_count,
+        )
+
+    def test_shopping_cart(self):
+        recipe = self.recipes[1]
+        self.assertConflicts(
+            f'/api/recipes/{recipe.id}/shopping_cart/',
+            ShoppingCart._meta.db_table,
+            ShoppingCart.objects.filter(user=self.user, recipe=recipe),
+            lambda: Recipe.objects.get(pk=recipe.pk).shopping_cart_count,
+        )
+
+    def test_subscribe(self):
+        self.assertConflicts(
+            f'/api/users/{self.author.id}/subscribe/',
+            Subscriptions._meta.db_table,
+            Subscriptions.objects.filter(user=self.user, author=self.author),
+            lambda: User.objects.get(pk=self.author.pk).subscribers_count,
+        )
+
+
+class RecipeUpdateQueriesTest(APITestCase):
+    """PATCH рецепта пишет только изменившиеся ингредиенты.
+
+    Общая часть запроса: рецепт, проверка ингредиентов, сохранение
+    рецепта со сбросом снимка, текущие ингредиенты, ответ со свежим,
+    но не записанным снимком и отметками читателя и смена поколения
+    'recipes' после фиксации. В SQLite к ней добавляются два запроса
+    к таблице FTS5. Итоги списка покупок читателя, у которого
+    рецепт в корзине, должны совпасть с новыми количествами.
+    """
+
+    queries = 11 if connection.vendor == 'postgresql' else 13
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.recipes[1]
+        with self.committed():
+            self.extra = Ingredient.objects.create(name='Добавка',
+                                                   measurement_unit='г')
+        get_generation('pantry')
+        ShoppingListItem.objects.rebuild()
+        self.client.force_authenticate(self.author)
+
+    def patch(self, amounts, queries):
+        with self.assertNumQueries(self.queries + queries), self.committed():
+            response = self.client.patch(
+                f'/api/recipes/{self.recipe.id}/',
+                {'ingredients': [{'id': ingredient.id, 'amount': amount}
+                                 for ingredient, amount in amounts.items()]},
+                format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        expected = {ingredient.id: amount
+                    for ingredient, amount in amounts.items()}
+        self.assertEqual(dict(self.recipe.recipes.values_list(
+            'ingredient_id', 'amount'
+        )), expected)
+        self.assertEqual(dict(ShoppingListItem.objects.filter(
+            user=self.user
+        ).values_list('ingredient_id', 'amount')), expected)
+
+    def test_no_changes(self):
+        self.patch({ingredient: 10 for ingredient in self.ingredients}, 0)
+
+    def test_amount_changed(self):
+        """Одно UPDATE количеств и одно изменение итогов."""
+        first, *rest = self.ingredients
+        self.patch({first: 15, **{ingredient: 10 for ingredient in rest}}, 2)
+
+    def test_ingredients_added_and_removed(self):
+        """Удаление, вставка, изменение итогов и индекс подбора.
+
+        Итоги после вычитания чистятся от нулевых строк, индекс
+        подбора по продуктам после фиксации читает новые ингредиенты
+        рецепта и меняет поколение 'pantry'.
+        """
+        self.patch({**{ingredient: 10 for ingredient in self.ingredients[1:]},
+                    self.extra: 5}, 6)
+
+
+class RecipeWriteQueriesTest(APITestCase):
+    """Создание, изменение и удаление рецепта укладываются в QUERY_BUDGET.
+
+    Считаются и действия после фиксации, кроме картинок, которые
+    строит фоновый пул. Снимок сбрасывается и поколение 'recipes'
+    меняется один раз за запрос, а не на каждую строку ингредиентов
+    и тегов. В SQLite к бюджету добавляются два запроса к таблице FTS5.
+    """
+
+    image = ('data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAAC'
+             'Qd1PeAAAADElEQVR4nGP4z8AAAAMBAQDJ/pLvAAAAAElFTkSuQmCC')
+
+    def setUp(self):
+        super().setUp()
+        for namespace in ('recipes', 'pantry'):
+            get_generation(namespace)
+        self.client.force_authenticate(self.author)
+        self.budget = settings.QUERY_BUDGET
+        if connection.vendor != 'postgresql':
+            self.budget += 2
+
+    def write(self, method, url, status, data=None):
+        generation = get_generation('recipes')
+        with TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root), \
+                mock.patch('api.signals.schedule_thumbnails'), \
+                CaptureQueriesContext(connection) as queries, \
+                self.committed():
+            response = getattr(self.client, method)(url, data,
+                                                    format='json')
+        self.assertEqual(response.status_code, status)
+        self.assertLessEqual(len(queries), self.budget)
+        statements = Counter(
+            'snapshot' if '"snapshot_version" + 1' in query['sql']
+            else 'generation' if query['sql'].startswith(
+                f'UPDATE {Generation._meta.db_table}'
+            ) else None
+            for query in queries
+        )
+        self.assertLessEqual(statements['snapshot'], 1)
+        self.assertLessEqual(statements['generation'], 2)
+        self.assertGreater(get_generation('recipes'), generation)
+        return response
+
+    def test_create_update_delete(self):
+        data = {
+            'name': 'Новый рецепт', 'text': 'Описание', 'cooking_time': 5,
+            'image': self.image, 'tags': [tag.id for tag in self.tags],
+            'ingredients': [{'id': ingredient.id, 'amount': 3}
+                            for ingredient in self.ingredients],
+        }
+        recipe_id = self.write('post', '/api/recipes/', 201, data).data['id']
+        url = f'/api/recipes/{recipe_id}/'
+        self.write('patch', url, 200, {
+            'name': 'Новое название', 'tags': [self.tags[0].id],
+            'ingredients': [{'id': self.ingredients[0].id, 'amount': 4}],
+        })
+        recipe = self.client.get(url).data
+        self.assertEqual(recipe['name'], 'Новое название')
+        self.assertEqual([tag['id'] for tag in recipe['tags']],
+                         [self.tags[0].id])
+        self.assertEqual([(ingredient['id'], ingredient['amount'])
+                          for ingredient in recipe['ingredients']],
+                         [(self.ingredients[0].id, 4)])
+        self.write('delete', url, 204)
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'], ASYNC_DB_WORKERS=1,
+                   ROOT_URLCONF=(path('api/', include('api.async_urls')),))
+class AsyncViewsTest(TransactionTestCase):
+    """Асинхронные представления отвечают так же, как синхронные."""
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.user = create_user(1)
+        self.recipe, = create_recipes(create_user(2), 1, (), ())
+        self.token = Token.objects.create(user=self.user)
+        self.client = AsyncClient()
+
+    def tearDown(self):
+        if async_views.executor is not None:
+            async_views.executor.submit(connections.close_all).result()
+            async_views.executor.shutdown()
+            async_views.executor = None
+
+    async def get(self, url):
+        return await self.client.get(
+            url, authorization=f'Token {self.token.key}'
+        )
+
+    async def test_recipe_detail(self):
+        response = await self.get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], self.recipe.id)
+
+    async def test_recipe_detail_with_invalid_id(self):
+        response = await self.get('/api/recipes/abc/')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_permissions_checked_once(self):
+        """Быстрый путь проходит initial(), синхронный не вызывается."""
+        with mock.patch.object(RecipeViewSet, 'check_permissions') as check:
+            response = await self.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        check.assert_called_once()
+
+    async def test_errors_in_code_are_raised(self):
+        with mock.patch.object(async_views, 'paginate',
+                               side_effect=TypeError), \
+                self.assertRaises(TypeError):
+            await self.get('/api/recipes/')
+
+
+@contextmanager
+def drf_fields():
+    """Сериализаторы ответов со стандартным обходом полей DRF."""
+    with ExitStack() as stack:
+        for serializer_class in (IngredientRecipeSerializer,
+                                 PantryRecipeSerializer, RecipeSerializer,
+                                 RecipeShortSerializer,
+                                 SubscriptionSerializer, TagSerializer,
+                                 UserSerializer):
+            stack.enter_context(mock.patch.object(
+                serializer_class, 'to_representation',
+                serializers.Serializer.to_representation,
+            ))
+        yield
+
+
+class SerializerOutputTest(APITestCase):
+    """Словари сериализаторов и ORJSONRenderer против эталона DRF.
+
+    Эталон - стандартный Serializer.to_representation у всех
+    сериализаторов ответа, отрисованный JSONRenderer.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.request = Request(RequestFactory().get('/api/recipes/'))
+        self.request.user = self.user
+
+    def assertSameOutput(self, serializer_class, objects):
+        def serialize():
+            return serializer_class(objects, many=True,
+                                    context={'request': self.request}).data
+
+        data = serialize()
+        with drf_fields():
+            expected = JSONRenderer().render(serialize())
+        self.assertEqual(JSONRenderer().render(data), expected)
+        self.assertEqual(ORJSONRenderer().render(data), expected)
+
+    def page(self):
+        recipes = list(Recipe.objects.all()[:6])
+        prefetch_related_objects(recipes, *snapshot_lookups())
+        return recipes
+
+    def test_recipes(self):
+        """Со сборкой снимков и со снимками из базы."""
+        self.assertSameOutput(RecipeSerializer, self.page())
+        self.assertSameOutput(RecipeSerializer, self.page())
+
+    def test_pantry_recipes(self):
+        recipes = self.page()
+        for number, recipe in enumerate(recipes, start=1):
+            recipe.coverage = 1 / number if number % 2 else 0.1 ** number
+            recipe.missing_ingredients = number - 1
+        self.assertSameOutput(PantryRecipeSerializer, recipes)
+
+    def test_subscriptions(self):
+        authors = list(User.objects.filter(
+            subscribing__user=self.user
+        ).annotate(
+            is_subscribed=Value(True),
+            subscription_id=F('subscribing__id'),
+        ))
+        for author in authors:
+            author.latest_recipes = list(
+                Recipe.objects.latest_by_author([author], 3)
+            )
+        self.assertSameOutput(SubscriptionSerializer, authors)
+
+
+class LoadIngredientsTest(APITestCase):
+
+    def test_update_units_resets_recipe_snapshots(self):
+        """Смена единиц загрузкой видна в ответе со снимком."""
+        url = f'/api/recipes/{self.recipes[0].id}/'
+        self.client.get(url)
+        self.assertIsNotNone(
+            Recipe.objects.get(pk=self.recipes[0].pk).snapshot
+        )
+        with NamedTemporaryFile('w', suffix='.csv', encoding='utf-8') as file:
+            file.write(f'{self.ingredients[0].name},кг\n')
+            file.flush()
+            call_command('load_ingredients', file.name, update=True,
+                         stdout=StringIO())
+        units = {ingredient['id']: ingredient['measurement_unit']
+                 for ingredient in self.client.get(url).data['ingredients']}
+        self.assertEqual(units[self.ingredients[0].id], 'кг')
+        self.assertEqual(units[self.ingredients[1].id], 'г')
+
+
+@override_settings(VIEWER_SHARED_CACHE=True)
+class ViewerContextTest(APITestCase):
+    """Отметки читателя из общего кэша после удаления связей."""
+
+    def assertMarks(self, **marks):
+        recipe = self.client.get(f'/api/recipes/{self.recipes[0].id}/').data
+        self.assertEqual({name: recipe[name] for name in marks}, marks)
+
+    def delete(self, url):
+        with self.committed():
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, 204)
+
+    def test_favorite_removed(self):
+        url = f'/api/recipes/{self.recipes[0].id}/favorite/'
+        self.assertMarks(is_favorited=True)
+        with CaptureQueriesContext(connection) as queries:
+            self.delete(url)
+        self.assertFalse(any(
+            query['sql'].startswith('SELECT')
+            and Favorites._meta.db_table in query['sql']
+            for query in queries
+        ), 'Удаление читает строки избранного.')
+        self.assertMarks(is_favorited=False)
+
+    def test_shopping_cart_cleared(self):
+        with self.committed():
+            response = self.client.post(
+                f'/api/recipes/{self.recipes[0].id}/shopping_cart/'
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertMarks(is_in_shopping_cart=True)
+        self.delete('/api/recipes/shopping_cart/clear/')
+        self.assertMarks(is_in_shopping_cart=False)
+
+    def test_favorite_removed_in_admin(self):
+        admin = User.objects.create_superuser(
+            email='admin@test.foodgram', username='admin', password='x'
+        )
+        self.assertMarks(is_favorited=True)
+        admin_client = Client()
+        admin_client.force_login(admin)
+        favorite = Favorites.objects.get(user=self.user)
+        with self.committed():
+            response = admin_client.post(
+                '/admin/foodgram/favorites/',
+                {'action': 'delete_selected',
+                 '_selected_action': [favorite.pk], 'post': 'yes'},
+            )
+        self.assertEqual(response.status_code, 302)
+        self.assertMarks(is_favorited=False)
+
+    def test_shopping_cart_moved(self):
+        """Связь, перенесённую на другой рецепт, видно сразу."""
+        self.assertMarks(is_in_shopping_cart=False)
+        item = ShoppingCart.objects.get(user=self.user)
+        item.recipe = self.recipes[0]
+        with self.committed():
+            item.save()
+        self.assertMarks(is_in_shopping_cart=True)
+
+    def test_recipe_deleted(self):
+        """Каскадное удаление избранного меняет поколение читателя."""
+        recipe_id = self.recipes[0].id
+        self.assertIn(recipe_id, ViewerContext.load(self.user).favorites)
+        with self.committed():
+            self.recipes[0].delete()
+        self.assertNotIn(recipe_id, ViewerContext.load(self.user).favorites)
+
+    @override_settings(VIEWER_SHARED_CACHE=False)
+    def test_no_generation_without_shared_cache(self):
+        """Без общего кэша поколение читателя не меняется."""
+        with CaptureQueriesContext(connection) as queries, self.committed():
+            self.delete(f'/api/recipes/{self.recipes[0].id}/favorite/')
+            Favorites.objects.filter(user=self.user).delete()
+        self.assertFalse(any(Generation._meta.db_table in query['sql']
+                             for query in queries))
+
+    def test_unsubscribed(self):
+        self.client.get('/api/recipes/')
+        self.assertTrue(self.client.get(
+            f'/api/recipes/{self.recipes[0].id}/'
+        ).data['author']['is_subscribed'])
+        self.delete(f'/api/users/{self.author.id}/subscribe/')
+        self.assertFalse(self.client.get(
+            f'/api/recipes/{self.recipes[0].id}/'
+        ).data['author']['is_subscribed'])
@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import CharField, Value
+from foodgram.models import Favorites, ShoppingCart, Subscriptions
+
+from .cache import bump_generation_on_commit, get_generation
+
+
+def viewer_namespace(user_id):
+    return f'viewer:{user_id}'
+
+
+def forget_viewer(user_id):
+    """Смена поколения множеств пользователя после записи его связей.
+
+    Поколение меняется после фиксации, один раз за транзакцию, и только
+    при VIEWER_SHARED_CACHE: без общего кэша его никто не читает.
+    """
+    if settings.VIEWER_SHARED_CACHE:
+        bump_generation_on_commit(viewer_namespace(user_id))
+
+
+class ViewerContext:
+    """Избранное, корзина и подписки пользователя множествами id.
+
+    Отметки is_favorited, is_in_shopping_cart и is_subscribed
+    проверяются вхождением в множество, а не запросом на объект.
+    Множества загружаются одним запросом. При VIEWER_SHARED_CACHE они
+    хранятся в общем кэше под поколением пользователя, которое меняет
+    forget_viewer: представления API рядом с записью в обход ORM,
+    сигналы - при записи Favorites, ShoppingCart и Subscriptions через
+    ORM, в админке и каскадом. Локальный кэш процесса
+    другие воркеры не видят, поэтому без общего кэша множества
+    загружаются на каждый запрос.
+    """
+
+    def __init__(self, favorites=(), cart=(), subscriptions=()):
+        self.favorites = frozenset(favorites)
+        self.cart = frozenset(cart)
+        self.subscriptions = frozenset(subscriptions)
+
+    @classmethod
+    def load(cls, user):
+        if user is None or user.is_anonymous:
+            return cls()
+        if not settings.VIEWER_SHARED_CACHE:
+            return cls(*cls.fetch(user.id))
+        namespace = viewer_namespace(user.id)
+        key = f'{namespace}:{get_generation(namespace)}'
+        sets = cache.get(key)
+        if sets is None:
+            sets = cls.fetch(user.id)
+            cache.set(key, sets, settings.VIEWER_CACHE_TIMEOUT)
+        return cls(*sets)
+
+    @staticmethod
+    def fetch(user_id):
+        """Множества id из базы одним запросом UNION ALL."""
+        sets = {'favorites': set(), 'cart': set(), 'subscriptions': set()}
+        queries = (
+            (Favorites, 'favorites', 'recipe_id'),
+            (ShoppingCart, 'cart', 'recipe_id'),
+            (Subscriptions, 'subscriptions', 'author_id'),
+        )
+        first, *rest = (
+            model.objects.filter(user_id=user_id).order_by().annotate(
+                kind=Value(kind, output_field=CharField())
+            ).values_list('kind', field)
+            for model, kind, field in queries
+        )
+        for kind, target_id in first.union(*rest, all=True):
+            sets[kind].add(target_id)
+        return sets['favorites'], sets['cart'], sets['subscriptions']
+
+
+def viewer_context(request):
+    """ViewerContext пользователя запроса, один на запрос."""
+    if request is None:
+        return ViewerContext()
+    context = getattr(request, 'viewer_context', None)
+    if context is None:
+        context = ViewerContext.load(request.user)
+        request.viewer_context = context
+    return context
@@ -1,21 +1,37 @@
-from django.db.models import Sum
-from django.shortcuts import HttpResponse, get_object_or_404
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Value
+from django.http import Http404, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from foodgram.models import (Favorites, Ingredient, IngredientForRecipe,
-                             Recipe, ShoppingCart, Subscriptions, Tag, User)
+from foodgram.models import (Favorites, Ingredient, Recipe, ShoppingCart,
+                             ShoppingListItem, Subscriptions, Tag,
+                             TimelineEntry, User)
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import (AllowAny, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 
+from .cache import AnonymousCacheMixin, ReferenceDataMixin
 from .filters import IngredientFilter, RecipeFilter
-from .pagination import PageNumberLimitPagination
+from .indexes import ingredient_index, pantry_index
+from .pagination import (FeedPagination, PageNumberLimitPagination,
+                         RecipePagination, SubscriptionPagination)
+from .renderers import CSVRenderer, PDFRenderer, PlainTextRenderer
 from .serializers import (FavoriteSerializer, IngredientSerializer,
-                          RecipeCreateSerializer, RecipeSerializer,
+                          PantryRecipeSerializer, RecipeCreateSerializer,
+                          RecipeIdsSerializer, RecipeSerializer,
                           ShoppingCartSerializer, SubscriptionSerializer,
                           TagSerializer, UserSubscribeSerializer)
+from .shopping_list import EXPORTERS
+from .viewer import forget_viewer
+
+SHOPPING_LIST_CHUNK_SIZE = 500
 
 
 class UserViewSet(UserViewSet):
@@ -25,12 +41,26 @@ class UserViewSet(UserViewSet):
 
     @action(detail=False,
             methods=['get'],
-            permission_classes=(IsAuthenticated,)
+            permission_classes=(IsAuthenticated,),
+            pagination_class=SubscriptionPagination,
             )
     def subscriptions(self, request):
         """Список подписок."""
-        queryset = User.objects.filter(subscribing__user=request.user)
+        queryset = User.objects.filter(
+            subscribing__user=request.user
+        ).annotate(
+            is_subscribed=Value(True),
+            subscription_id=F('subscribing__id'),
+        ).order_by('-id')
         page = self.paginate_queryset(queryset)
+        recipes_limit = request.query_params.get('recipes_limit')
+        latest_recipes = defaultdict(list)
+        for recipe in Recipe.objects.latest_by_author(
+            page, int(recipes_limit) if recipes_limit else None
+        ):
+            latest_recipes[recipe.author_id].append(recipe)
+        for author in page:
+            author.latest_recipes = latest_recipes[author.id]
         serializer = SubscriptionSerializer(
             page,
             many=True,
@@ -55,31 +85,40 @@ class UserViewSet(UserViewSet):
             serializer.save(pk=id)
             return Response(status=status.HTTP_201_CREATED)
         if request.method == 'DELETE':
-            subscription = get_object_or_404(
-                Subscriptions, user=self.request.user,
-                author=get_object_or_404(User, id=id)
-            )
-            subscription.delete()
+            with transaction.atomic():
+                if not Subscriptions.objects.remove_many(request.user.id,
+                                                         [id]):
+                    raise Http404
+                authors = User.objects.filter(pk=id)
+                authors.update(subscribers_count=F('subscribers_count') - 1)
+                TimelineEntry.objects.remove_author(request.user.id, id)
+                if (authors.values_list('subscribers_count', flat=True)[0]
+                        == settings.FEED_FANOUT_LIMIT):
+                    TimelineEntry.objects.add_author_to_all(id)
+                forget_viewer(request.user.id)
             return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ReferenceDataMixin, viewsets.ReadOnlyModelViewSet):
     """Список тэгов."""
 
+    cache_namespace = 'tags'
     serializer_class = TagSerializer
     queryset = Tag.objects.all()
     permission_classes = (AllowAny,)
     pagination_class = None
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(AnonymousCacheMixin, viewsets.ModelViewSet):
     """Страница рецептов."""
 
+    cache_namespace = 'recipes'
     queryset = Recipe.objects.all()
     permission_classes = (IsAuthenticatedOrReadOnly,)
-    filter_backends = (DjangoFilterBackend,)
+    filter_backends = (DjangoFilterBackend, OrderingFilter)
     filterset_class = RecipeFilter
-    pagination_class = PageNumberLimitPagination
+    ordering_fields = ('pub_date', 'favorites_count', 'shopping_cart_count')
+    pagination_class = RecipePagination
     http_method_names = ('get', 'post', 'patch', 'delete',)
 
     def get_serializer_class(self):
@@ -107,8 +146,13 @@ class RecipeViewSet(viewsets.ModelViewSet):
             serializer.is_valid(raise_exception=True)
             response_data = serializer.save(id=pk)
             return Response(response_data, status=status.HTTP_201_CREATED)
-        recipe = Favorites.objects.filter(user=request.user, recipe__id=pk)
-        recipe.delete()
+        with transaction.atomic():
+            if not Favorites.objects.remove_many(request.user.id, [pk]):
+                raise Http404
+            Recipe.objects.filter(pk=pk).update(
+                favorites_count=F('favorites_count') - 1
+            )
+            forget_viewer(request.user.id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=True,
@@ -125,41 +169,200 @@ class RecipeViewSet(viewsets.ModelViewSet):
             serializer.is_valid(raise_exception=True)
             response_data = serializer.save(id=pk)
             return Response(response_data, status=status.HTTP_201_CREATED)
-        recipe = ShoppingCart.objects.filter(
-            user=request.user, recipe__id=pk)
-        recipe.delete()
+        with transaction.atomic():
+            if not ShoppingCart.objects.remove_many(request.user.id, [pk]):
+                raise Http404
+            ShoppingListItem.objects.add_recipe(
+                pk, user_id=request.user.id, multiplier=-1
+            )
+            Recipe.objects.filter(pk=pk).update(
+                shopping_cart_count=F('shopping_cart_count') - 1
+            )
+            forget_viewer(request.user.id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False,
+            methods=['post', 'delete'],
+            permission_classes=(IsAuthenticated,),
+            url_path='favorite',
+            url_name='favorite-batch',
+            )
+    def favorite_batch(self, request):
+        """Добавление/удаление нескольких рецептов в избранные."""
+        return self.change_many(request, Favorites, 'favorites_count')
+
+    @action(detail=False,
+            methods=['post', 'delete'],
+            permission_classes=(IsAuthenticated,),
+            url_path='shopping_cart',
+            url_name='shopping-cart-batch',
+            )
+    def shopping_cart_batch(self, request):
+        """Добавление/удаление нескольких рецептов в корзину."""
+        return self.change_many(request, ShoppingCart, 'shopping_cart_count')
+
+    @action(detail=False,
+            methods=['delete'],
+            permission_classes=(IsAuthenticated,),
+            url_path='shopping_cart/clear',
+            url_name='shopping-cart-clear',
+            )
+    def clear_shopping_cart(self, request):
+        """Очистка корзины."""
+        with transaction.atomic():
+            removed = ShoppingCart.objects.remove_many(request.user.id)
+            if removed:
+                ShoppingListItem.objects.filter(user=request.user).delete()
+                Recipe.objects.filter(pk__in=removed).update(
+                    shopping_cart_count=F('shopping_cart_count') - 1
+                )
+                forget_viewer(request.user.id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def change_many(self, request, model, counter):
+        """Пакетное добавление или удаление связей с рецептами.
+
+        Все рецепты обрабатываются в одной транзакции несколькими
+        запросами независимо от их числа. В ответе для каждого id
+        указан результат: added, exists, removed или not_found.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        with transaction.atomic():
+            if request.method == 'POST':
+                changed = model.objects.add_many(request.user.id, recipe_ids)
+                existing = set(Recipe.objects.filter(
+                    pk__in=set(recipe_ids) - changed
+                ).values_list('id', flat=True))
+                results = {recipe_id: 'exists' for recipe_id in existing}
+                results.update((recipe_id, 'added') for recipe_id in changed)
+                delta = 1
+            else:
+                changed = model.objects.remove_many(request.user.id,
+                                                    recipe_ids)
+                results = {recipe_id: 'removed' for recipe_id in changed}
+                delta = -1
+            if changed:
+                Recipe.objects.filter(pk__in=changed).update(
+                    **{counter: F(counter) + delta}
+                )
+                if model is ShoppingCart:
+                    ShoppingListItem.objects.add_recipes(
+                        changed, request.user.id, delta
+                    )
+                forget_viewer(request.user.id)
+        return Response({'results': [
+            {'id': recipe_id, 'status': results.get(recipe_id, 'not_found')}
+            for recipe_id in recipe_ids
+        ]})
+
     @action(detail=False,
             methods=['get'],
-            permission_classes=(IsAuthenticated,)
+            permission_classes=(IsAuthenticated,),
+            pagination_class=FeedPagination,
+            )
+    def feed(self, request):
+        """Лента рецептов авторов, на которых подписан пользователь."""
+        keys = self.paginator.paginate_keys(
+            lambda limit, before: TimelineEntry.objects.feed(
+                request.user.id, limit, before
+            ),
+            request,
+        )
+        recipes = Recipe.objects.in_bulk(
+            [recipe_id for _, recipe_id in keys]
+        )
+        serializer = RecipeSerializer(
+            [recipes[recipe_id] for _, recipe_id in keys
+             if recipe_id in recipes],
+            many=True,
+            context={'request': request},
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False,
+            methods=['get'],
+            pagination_class=PageNumberLimitPagination,
+            )
+    def pantry(self, request):
+        """Рецепты из имеющихся ингредиентов.
+
+        Ингредиенты передаются через запятую: ?ingredients=1,2,3.
+        Рецепты отсортированы по доле ингредиентов, которые уже есть,
+        затем по числу недостающих.
+        """
+        try:
+            ingredient_ids = {
+                int(value)
+                for values in request.query_params.getlist('ingredients')
+                for value in values.split(',') if value.strip()
+            }
+        except ValueError:
+            raise ValidationError(
+                {'ingredients': 'Нужен список id ингредиентов.'}
+            )
+        if not ingredient_ids:
+            raise ValidationError(
+                {'ingredients': 'Укажите хотя бы один ингредиент.'}
+            )
+        page = self.paginate_queryset(pantry_index.match(ingredient_ids))
+        recipes = Recipe.objects.in_bulk(
+            [recipe_id for recipe_id, _, _ in page]
+        )
+        results = []
+        for recipe_id, found, total in page:
+            recipe = recipes.get(recipe_id)
+            if recipe is not None:
+                recipe.coverage = found / total
+                recipe.missing_ingredients = total - found
+                results.append(recipe)
+        serializer = PantryRecipeSerializer(results, many=True,
+                                            context={'request': request})
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False,
+            methods=['get'],
+            permission_classes=(IsAuthenticated,),
+            renderer_classes=(PlainTextRenderer, CSVRenderer, PDFRenderer),
             )
     def download_shopping_cart(self, request):
-        """Отправка файла со списком покупок."""
-        user = request.user
-        amount_list = IngredientForRecipe.objects.filter(
-            recipe__shopping_cart__user=user
+        """Отправка файла со списком покупок.
+
+        Формат выбирается параметром ?format= (txt, csv, pdf), строки
+        берутся из заранее посчитанных итогов и отдаются потоком.
+        """
+        file_format = request.accepted_renderer.format
+        items = ShoppingListItem.objects.filter(
+            user=request.user
         ).values(
+            'ingredient__name', 'ingredient__measurement_unit', 'amount'
+        ).order_by(
             'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-        shopping_list = ['Список покупок:\n']
-        for i in amount_list:
-            shopping_list.append(
-                f"\n{i['ingredient__name']} "
-                f"({i['ingredient__measurement_unit']}) - "
-                f"{i['amount']}")
-        response = HttpResponse(shopping_list, content_type='text/plain')
-        response['Content-Disposition'] = \
-            'attachment; filename="shopping_cart.txt"'
+        ).iterator(chunk_size=SHOPPING_LIST_CHUNK_SIZE)
+        response = StreamingHttpResponse(
+            EXPORTERS[file_format](items),
+            content_type=request.accepted_renderer.media_type,
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_cart.{file_format}"'
+        )
         return response
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ReferenceDataMixin, viewsets.ReadOnlyModelViewSet):
     """Список игредиентов."""
 
+    cache_namespace = 'ingredients'
     serializer_class = IngredientSerializer
     queryset = Ingredient.objects.all()
     permission_classes = (AllowAny,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
     pagination_class = None
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name is None:
+            return super().list(request, *args, **kwargs)
+        return Response(ingredient_index.search(name))
@@ -50,6 +50,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -96,6 +97,43 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+if os.getenv('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+    }
+
+# Поколения данных (api/cache.py) хранятся в общем кэше, если он есть,
+# иначе в базе: локальный кэш процесса не видит смен поколения из
+# других процессов и management-команд.
+GENERATIONS_IN_CACHE = bool(os.getenv('REDIS_URL'))
+
+RESPONSE_CACHE_TIMEOUT = 60 * 10
+
+REFERENCE_DATA_MAX_AGE = 60 * 60
+
+AUTH_TOKEN_CACHE_TIMEOUT = 60 * 5
+
+AUTH_TOKEN_LOCAL_TIMEOUT = 10
+
+AUTH_TOKEN_LOCAL_SIZE = 10000
+
+AUTH_TOKEN_SHARED_CACHE = bool(os.getenv('REDIS_URL'))
+
+VIEWER_CACHE_TIMEOUT = 60 * 10
+
+VIEWER_SHARED_CACHE = bool(os.getenv('REDIS_URL'))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -138,6 +176,20 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = '/media'
 
+RECIPE_IMAGE_SIZES = {
+    'small': 320,
+    'medium': 640,
+    'large': 1280,
+}
+
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', default=2))
+
+# Асинхронные представления api/async_views.py, запуск под ASGI:
+# gunicorn backend.asgi:application -k uvicorn.workers.UvicornWorker
+ASYNC_API = os.getenv('ASYNC_API', default='').lower() in ('1', 'true')
+
+ASYNC_DB_WORKERS = int(os.getenv('ASYNC_DB_WORKERS', default=16))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -145,13 +197,38 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'foodgram.User'
 
+INGREDIENT_SEARCH_LIMIT = 50
+
+# Как долго процесс подбирает рецепты по продуктам, не сверяя
+# свой индекс с изменениями в других процессах.
+PANTRY_INDEX_MAX_AGE = int(os.getenv('PANTRY_INDEX_MAX_AGE', default=60))
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+COUNT_ESTIMATE_THRESHOLD = 100000
+
+FEED_FANOUT_LIMIT = 1000
+
+QUERY_BUDGET = int(os.getenv('QUERY_BUDGET', default=20))
+
+METRICS_ALLOWED_IPS = os.getenv('METRICS_ALLOWED_IPS',
+                                default='127.0.0.1').split(',')
+
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachingTokenAuthentication',
+    ],
+
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
 
     'DEFAULT_PAGINATION_CLASS': [
@@ -1,7 +1,11 @@
+from api.metrics import metrics
+from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/', include('api.urls'))
+    path('api/', include('api.async_urls' if settings.ASYNC_API
+                         else 'api.urls')),
+    path('metrics', metrics),
 ]
@@ -1,7 +1,13 @@
 from django.contrib import admin
 
 from .models import (Favorites, Ingredient, IngredientForRecipe, Recipe,
-                     ShoppingCart, Subscriptions, Tag, User)
+                     ShoppingCart, ShoppingListItem, Subscriptions, Tag, User)
+
+
+def rebuild_shopping_lists(user_ids):
+    """Пересчёт итогов списков покупок после правки в админке."""
+    for user_id in set(user_ids):
+        ShoppingListItem.objects.rebuild(user_id)
 
 
 class UserAdmin(admin.ModelAdmin):
@@ -32,20 +38,51 @@ class IngredientAdmin(admin.ModelAdmin):
         model = IngredientForRecipe
 
 
+class RecipeIngredientInline(admin.TabularInline):
+    model = IngredientForRecipe
+
+
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'author', 'favorites_amount',)
+    list_display = ('id', 'name', 'author', 'favorites_amount',
+                    'shopping_cart_count',)
     search_fields = ('name', 'author',)
     list_filter = ('name', 'author', 'tags',)
+    inlines = (RecipeIngredientInline,)
     empty_value_display = '-пусто-'
 
     """Количество добавления рецепта в избранное."""
 
+    @admin.display(description='В избранном',
+                   ordering='favorites_count')
     def favorites_amount(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if any(formset.has_changed() for formset in formsets):
+            rebuild_shopping_lists(ShoppingCart.objects.filter(
+                recipe=form.instance
+            ).values_list('user_id', flat=True))
 
-class RecipeIngredientInline(admin.TabularInline):
-    model = IngredientForRecipe
+
+class ShoppingCartAdmin(admin.ModelAdmin):
+    """Корзины: итоги списков покупок пересчитываются после правки."""
+
+    def save_model(self, request, obj, form, change):
+        users = [obj.user_id]
+        if change:
+            users.append(ShoppingCart.objects.get(pk=obj.pk).user_id)
+        super().save_model(request, obj, form, change)
+        rebuild_shopping_lists(users)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        rebuild_shopping_lists([obj.user_id])
+
+    def delete_queryset(self, request, queryset):
+        users = list(queryset.values_list('user_id', flat=True))
+        super().delete_queryset(request, queryset)
+        rebuild_shopping_lists(users)
 
 
 admin.site.register(User, UserAdmin)
@@ -53,5 +90,5 @@ admin.site.register(Tag, TagAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(Subscriptions)
-admin.site.register(ShoppingCart)
+admin.site.register(ShoppingCart, ShoppingCartAdmin)
 admin.site.register(Favorites)
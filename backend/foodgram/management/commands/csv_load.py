@@ -1,21 +0,0 @@
-import csv
-import os
-
-from django.conf import settings
-from django.core.management.base import BaseCommand
-from foodgram.models import Ingredient
-
-
-class Command(BaseCommand):
-    def handle(self, *args, **options):
-        with open(
-            os.path.join(
-                settings.BASE_DIR,
-                'data', 'ingredients.csv'
-            ),
-            'r', encoding='utf-8'
-        ) as f:
-            csv_reader = csv.reader(f, delimiter=',')
-            for row in csv_reader:
-                Ingredient.objects.create(name=row[0],
-                                          measurement_unit=row[1])
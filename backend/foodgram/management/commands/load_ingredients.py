@@ -0,0 +1,104 @@
+import csv
+import json
+import os
+import time
+
+from api.cache import bump_generation
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from foodgram.models import Ingredient, Recipe
+
+
+class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV или JSON пачками.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?',
+            default=os.path.join(settings.BASE_DIR, 'data', 'ingredients.csv'),
+            help='Путь к файлу .csv (название, единица) или .json.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--update', action='store_true',
+            help='Обновлять единицу измерения у ингредиентов, '
+                 'которые есть в базе под тем же названием.',
+        )
+
+    def read_csv(self, path):
+        with open(path, 'r', encoding='utf-8') as file:
+            for row in csv.reader(file, delimiter=','):
+                if row:
+                    yield row[0], row[1]
+
+    def read_json(self, path):
+        with open(path, 'r', encoding='utf-8') as file:
+            for note in json.load(file):
+                yield note['name'], note['measurement_unit']
+
+    def read(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.csv':
+            return self.read_csv(path)
+        if extension == '.json':
+            return self.read_json(path)
+        raise CommandError(f'Неизвестный формат файла: {path}')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rows = {
+            (name.strip(), unit.strip())
+            for name, unit in self.read(options['path'])
+        }
+        with transaction.atomic():
+            updated = 0
+            if options['update']:
+                updated = self.update_units(rows)
+            existing = Ingredient.objects.count()
+            Ingredient.objects.bulk_create(
+                [Ingredient(name=name, measurement_unit=unit)
+                 for name, unit in sorted(rows)],
+                batch_size=options['batch_size'],
+                ignore_conflicts=True,
+            )
+            created = Ingredient.objects.count() - existing
+            transaction.on_commit(lambda: bump_generation('ingredients'))
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано {len(rows)}, добавлено {created}, '
+            f'обновлено {updated} за {elapsed:.2f} с '
+            f'({len(rows) / elapsed:.0f} строк/с).'
+        ))
+
+    def update_units(self, rows):
+        """Замена единиц измерения у однозначно совпавших названий.
+
+        bulk_update не отправляет post_save, поэтому снимки рецептов с
+        изменёнными ингредиентами сбрасываются здесь.
+        """
+        units = {}
+        for name, unit in rows:
+            units.setdefault(name, set()).add(unit)
+        stored = {}
+        for ingredient in Ingredient.objects.filter(
+            name__in=list(units)
+        ).only('id', 'name', 'measurement_unit'):
+            stored.setdefault(ingredient.name, []).append(ingredient)
+        changed = []
+        for name, ingredients in stored.items():
+            if len(ingredients) != 1 or len(units[name]) != 1:
+                continue
+            ingredient, = ingredients
+            unit, = units[name]
+            if ingredient.measurement_unit != unit:
+                ingredient.measurement_unit = unit
+                changed.append(ingredient)
+        if changed:
+            Ingredient.objects.bulk_update(changed, ('measurement_unit',),
+                                           batch_size=1000)
+            Recipe.objects.filter(
+                recipes__ingredient__in=changed
+            ).invalidate_snapshots()
+            transaction.on_commit(lambda: bump_generation('recipes'))
+        return len(changed)
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from foodgram.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает итоги списков покупок по корзинам.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int,
+                            help='Пересчитать только этого пользователя.')
+        parser.add_argument('--check', action='store_true',
+                            help='Только сравнить итоги с корзинами.')
+
+    def handle(self, *args, **options):
+        user_id = options['user']
+        if options['check']:
+            return self.check_totals(user_id)
+        with transaction.atomic():
+            ShoppingListItem.objects.rebuild(user_id)
+        self.stdout.write(self.style.SUCCESS('Итоги пересчитаны.'))
+
+    def check_totals(self, user_id):
+        expected = {
+            (row['user'], row['recipe__recipes__ingredient']): row['total']
+            for row in ShoppingListItem.objects.expected(user_id).iterator()
+        }
+        items = ShoppingListItem.objects.all()
+        if user_id is not None:
+            items = items.filter(user=user_id)
+        stored = {
+            (user, ingredient): amount
+            for user, ingredient, amount in items.values_list(
+                'user', 'ingredient', 'amount'
+            ).iterator()
+        }
+        mismatches = [
+            (key, stored.get(key), expected.get(key))
+            for key in sorted(expected.keys() | stored.keys())
+            if stored.get(key) != expected.get(key)
+        ]
+        for (user, ingredient), actual, total in mismatches:
+            self.stdout.write(
+                f'Пользователь {user}, ингредиент {ingredient}: '
+                f'сохранено {actual}, в корзине {total}'
+            )
+        if mismatches:
+            raise CommandError(
+                f'Расхождений в итогах: {len(mismatches)}. '
+                'Запустите команду без --check для пересчёта.'
+            )
+        self.stdout.write(self.style.SUCCESS('Итоги совпадают с корзинами.'))
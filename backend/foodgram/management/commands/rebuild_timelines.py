@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from foodgram.models import TimelineEntry
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает ленты подписок по подпискам и рецептам.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int,
+                            help='Пересобрать только этого пользователя.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            TimelineEntry.objects.rebuild(options['user'])
+        self.stdout.write(self.style.SUCCESS('Ленты пересобраны.'))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+from foodgram.models import (Favorites, Recipe, ShoppingCart, Subscriptions,
+                             User, count_subquery)
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorites, 'recipe'),
+    (Recipe, 'shopping_cart_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscribers_count', Subscriptions, 'author'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Сверяет счётчики популярности с данными и исправляет их.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только найти расхождения.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        mismatches = 0
+        for model, field, source, source_field in COUNTERS:
+            drifted = list(model.objects.annotate(
+                actual=count_subquery(source, source_field)
+            ).exclude(**{field: F('actual')}).values_list(
+                'pk', field, 'actual'
+            ).order_by('pk'))
+            for pk, stored, actual in drifted:
+                self.stdout.write(
+                    f'{model._meta.verbose_name} {pk}, {field}: '
+                    f'сохранено {stored}, на самом деле {actual}'
+                )
+            mismatches += len(drifted)
+            if options['check']:
+                continue
+            batch_size = options['batch_size']
+            for start in range(0, len(drifted), batch_size):
+                model.objects.filter(pk__in=[
+                    pk for pk, _, _ in drifted[start:start + batch_size]
+                ]).update(**{field: count_subquery(source, source_field)})
+        if options['check'] and mismatches:
+            raise CommandError(
+                f'Расхождений в счётчиках: {mismatches}. '
+                'Запустите команду без --check для исправления.'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счётчиков: {mismatches}.' if mismatches
+            else 'Счётчики совпадают с данными.'
+        ))
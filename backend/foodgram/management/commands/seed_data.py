@@ -0,0 +1,215 @@
+import io
+import itertools
+import random
+import time
+from datetime import timedelta
+
+from api.cache import bump_generation
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from foodgram.models import (Favorites, Ingredient, IngredientForRecipe,
+                             Recipe, ShoppingCart, ShoppingListItem,
+                             Subscriptions, Tag, TimelineEntry, User)
+from foodgram.search import rebuild_search_index
+
+SEED_DOMAIN = 'seed.foodgram'
+
+WORDS = ('борщ', 'салат', 'суп', 'пирог', 'каша', 'рагу', 'запеканка',
+         'котлеты', 'паста', 'омлет', 'блины', 'плов', 'куриный', 'овощной',
+         'грибной', 'сырный', 'быстрый', 'домашний', 'летний', 'острый',
+         'chicken', 'soup', 'salad', 'cake', 'pasta', 'spicy', 'classic')
+
+
+def zipf_weights(count, exponent=1.1):
+    """Накопленные веса распределения Ципфа для random.choices."""
+    return list(itertools.accumulate(
+        1 / rank ** exponent for rank in range(1, count + 1)
+    ))
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, рецептами и '
+            'связями для нагрузочного тестирования.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--ingredients', type=int, default=2000,
+                            help='Минимальный размер каталога '
+                                 'ингредиентов, недостающие создаются.')
+        parser.add_argument('--tags', type=int, default=8,
+                            help='Минимальное число тегов.')
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8,
+                            help='Среднее число ингредиентов в рецепте.')
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='Среднее число подписок пользователя.')
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Среднее число рецептов в избранном.')
+        parser.add_argument('--carts', type=int, default=5,
+                            help='Среднее число рецептов в корзине.')
+        parser.add_argument('--days', type=int, default=365,
+                            help='За сколько дней распределить публикации.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=2000)
+        parser.add_argument('--clear', action='store_true',
+                            help='Удалить данные предыдущего запуска.')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        seeded = User.objects.filter(email__endswith=f'@{SEED_DOMAIN}')
+        started = time.monotonic()
+        with transaction.atomic():
+            if options['clear']:
+                seeded.delete()
+            elif seeded.exists():
+                raise CommandError('База уже заполнена, запустите команду '
+                                   'с --clear.')
+            tags = self.create_tags(options['tags'])
+            ingredients = self.create_ingredients(options['ingredients'])
+            users = self.create_users(options['users'])
+            recipes = self.create_recipes(users, options['recipes'],
+                                          options['days'])
+            self.fill_recipes(recipes, tags, ingredients,
+                              options['ingredients_per_recipe'])
+            self.create_relations(Subscriptions, 'author', users, users,
+                                  options['subscriptions'])
+            self.create_relations(Favorites, 'recipe', users, recipes,
+                                  options['favorites'])
+            self.create_relations(ShoppingCart, 'recipe', users, recipes,
+                                  options['carts'])
+            rebuild_search_index()
+            ShoppingListItem.objects.rebuild()
+            TimelineEntry.objects.rebuild()
+            call_command('reconcile_counters', stdout=io.StringIO())
+            for namespace in ('recipes', 'ingredients', 'tags', 'pantry'):
+                transaction.on_commit(
+                    lambda namespace=namespace: bump_generation(namespace)
+                )
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей {len(users)}, рецептов {len(recipes)} '
+            f'за {time.monotonic() - started:.1f} с.'
+        ))
+
+    def bulk_create(self, model, objects):
+        objects = iter(objects)
+        while True:
+            batch = list(itertools.islice(objects, self.batch_size))
+            if not batch:
+                return
+            model.objects.bulk_create(batch)
+
+    def create_tags(self, count):
+        existing = Tag.objects.count()
+        self.bulk_create(Tag, (
+            Tag(name=f'Тег {number}', slug=f'seed-{number}',
+                color=f'#{self.random.randrange(0x1000000):06X}')
+            for number in range(existing, count)
+        ))
+        return list(Tag.objects.order_by('id').values_list('id', flat=True))
+
+    def create_ingredients(self, count):
+        existing = Ingredient.objects.count()
+        self.bulk_create(Ingredient, (
+            Ingredient(name=f'{self.random.choice(WORDS)} {number}',
+                       measurement_unit=self.random.choice(('г', 'мл', 'шт')))
+            for number in range(existing, count)
+        ))
+        ids = list(Ingredient.objects.order_by('id').values_list(
+            'id', flat=True
+        ))
+        self.random.shuffle(ids)
+        return ids
+
+    def create_users(self, count):
+        password = make_password('seed-password')
+        self.bulk_create(User, (
+            User(email=f'user{number}@{SEED_DOMAIN}',
+                 username=f'seed_{number}', first_name='Имя',
+                 last_name=f'Фамилия {number}', password=password)
+            for number in range(count)
+        ))
+        return list(User.objects.filter(
+            email__endswith=f'@{SEED_DOMAIN}'
+        ).order_by('id').values_list('id', flat=True))
+
+    def create_recipes(self, users, count, days):
+        """Рецепты в хронологическом порядке.
+
+        Число рецептов у автора распределено по Ципфу: немногие
+        популярные авторы пишут большую часть рецептов.
+        """
+        if not users:
+            return []
+        authors = self.random.choices(users, cum_weights=zipf_weights(
+            len(users)), k=count)
+        self.bulk_create(Recipe, (
+            Recipe(author_id=author_id,
+                   name=' '.join(self.random.sample(WORDS, 3)).capitalize(),
+                   text=' '.join(self.random.choices(WORDS, k=30)),
+                   cooking_time=self.random.randint(5, 180))
+            for author_id in authors
+        ))
+        recipes = list(Recipe.objects.filter(
+            author__email__endswith=f'@{SEED_DOMAIN}'
+        ).order_by('id').values_list('id', flat=True))
+        now = timezone.now()
+        offsets = sorted((self.random.uniform(0, days * 86400)
+                          for _ in recipes), reverse=True)
+        Recipe.objects.bulk_update(
+            [Recipe(id=recipe_id, pub_date=now - timedelta(seconds=offset))
+             for recipe_id, offset in zip(recipes, offsets)],
+            ('pub_date',), batch_size=self.batch_size // 4,
+        )
+        return recipes
+
+    def fill_recipes(self, recipes, tags, ingredients, average):
+        """Теги и ингредиенты рецептов.
+
+        Частота ингредиентов распределена по Ципфу, как у соли и муки
+        в настоящих рецептах.
+        """
+        weights = zipf_weights(len(ingredients))
+        self.bulk_create(Recipe.tags.through, (
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipes
+            for tag_id in self.random.sample(tags,
+                                             min(len(tags),
+                                                 self.random.randint(1, 3)))
+        ))
+        self.bulk_create(IngredientForRecipe, (
+            IngredientForRecipe(recipe_id=recipe_id, ingredient_id=pk,
+                                amount=self.random.randint(1, 500))
+            for recipe_id in recipes
+            for pk in set(self.random.choices(
+                ingredients, cum_weights=weights,
+                k=self.random.randint(max(1, average // 2),
+                                      max(1, average * 3 // 2)),
+            ))
+        ))
+
+    def create_relations(self, model, field, users, targets, average):
+        """Связи пользователей с рецептами или авторами.
+
+        Популярность целей распределена по Ципфу, на авторов чаще
+        подписываются те же, кто больше пишет. Число связей у
+        пользователя распределено экспоненциально со средним average.
+        """
+        if not targets or not average:
+            return
+        ranked = (targets if field == 'author'
+                  else self.random.sample(targets, len(targets)))
+        weights = zipf_weights(len(ranked))
+        rows = (
+            model(user_id=user_id, **{f'{field}_id': target_id})
+            for user_id in users
+            for target_id in set(self.random.choices(
+                ranked, cum_weights=weights,
+                k=int(self.random.expovariate(1 / average)),
+            ))
+            if field != 'author' or target_id != user_id
+        )
+        self.bulk_create(model, rows)
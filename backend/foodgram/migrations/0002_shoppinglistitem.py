@@ -0,0 +1,69 @@
+# Generated by Django 3.2.3 on 2026-10-17 06:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def remove_duplicate_ingredients(apps, schema_editor):
+    IngredientForRecipe = apps.get_model('foodgram', 'IngredientForRecipe')
+    latest = IngredientForRecipe.objects.values(
+        'recipe', 'ingredient'
+    ).annotate(
+        latest_id=models.Max('id')
+    ).values('latest_id')
+    IngredientForRecipe.objects.exclude(id__in=latest).delete()
+
+
+def fill_shopping_lists(apps, schema_editor):
+    ShoppingCart = apps.get_model('foodgram', 'ShoppingCart')
+    ShoppingListItem = apps.get_model('foodgram', 'ShoppingListItem')
+    totals = ShoppingCart.objects.filter(
+        recipe__recipes__isnull=False
+    ).values(
+        'user', 'recipe__recipes__ingredient'
+    ).annotate(
+        total=models.Sum('recipe__recipes__amount')
+    ).order_by()
+    ShoppingListItem.objects.bulk_create(
+        (ShoppingListItem(user_id=row['user'],
+                          ingredient_id=row['recipe__recipes__ingredient'],
+                          amount=row['total'])
+         for row in totals.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_ingredients,
+                             migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='ingredientforrecipe',
+            unique_together={('recipe', 'ingredient')},
+        ),
+        migrations.CreateModel(
+            name='ShoppingListItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to='foodgram.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Позиция списка покупок',
+                'verbose_name_plural': 'Позиции списка покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglistitem',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_list_item'),
+        ),
+        migrations.RunPython(fill_shopping_lists,
+                             migrations.RunPython.noop),
+    ]
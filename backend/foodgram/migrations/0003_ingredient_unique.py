@@ -0,0 +1,52 @@
+# Generated by Django 3.2.3 on 2026-10-17 06:03
+
+from django.db import migrations, models
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('foodgram', 'Ingredient')
+    IngredientForRecipe = apps.get_model('foodgram', 'IngredientForRecipe')
+    ShoppingListItem = apps.get_model('foodgram', 'ShoppingListItem')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(
+        keep_id=models.Min('id'), total=models.Count('id')
+    ).filter(total__gt=1).order_by()
+    for row in duplicates:
+        extra_ids = Ingredient.objects.filter(
+            name=row['name'], measurement_unit=row['measurement_unit']
+        ).exclude(id=row['keep_id']).values_list('id', flat=True)
+        for extra_id in extra_ids:
+            for model, owner in ((IngredientForRecipe, 'recipe'),
+                                 (ShoppingListItem, 'user')):
+                extra = model.objects.filter(ingredient=extra_id)
+                kept = model.objects.filter(ingredient=row['keep_id'])
+                kept.filter(
+                    **{f'{owner}__in': extra.values(owner)}
+                ).update(amount=models.F('amount') + models.Subquery(
+                    extra.filter(
+                        **{owner: models.OuterRef(owner)}
+                    ).order_by().values(owner).annotate(
+                        total=models.Sum('amount')
+                    ).values('total')
+                ))
+                extra.exclude(
+                    **{f'{owner}__in': kept.values(owner)}
+                ).update(ingredient=row['keep_id'])
+        Ingredient.objects.filter(id__in=list(extra_ids)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0002_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
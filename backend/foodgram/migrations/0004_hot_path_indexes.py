@@ -0,0 +1,66 @@
+# Generated by Django 3.2.3 on 2026-10-17 06:05
+
+from django.db import migrations, models
+
+
+def remove_duplicates(model):
+    first = model.objects.values('user', 'recipe').annotate(
+        first_id=models.Min('id')
+    ).values('first_id')
+    deleted, _ = model.objects.exclude(id__in=first).delete()
+    return deleted
+
+
+def remove_duplicate_relations(apps, schema_editor):
+    remove_duplicates(apps.get_model('foodgram', 'Favorites'))
+    if not remove_duplicates(apps.get_model('foodgram', 'ShoppingCart')):
+        return
+    ShoppingCart = apps.get_model('foodgram', 'ShoppingCart')
+    ShoppingListItem = apps.get_model('foodgram', 'ShoppingListItem')
+    ShoppingListItem.objects.all().delete()
+    totals = ShoppingCart.objects.filter(
+        recipe__recipes__isnull=False
+    ).values(
+        'user', 'recipe__recipes__ingredient'
+    ).annotate(
+        total=models.Sum('recipe__recipes__amount')
+    ).order_by()
+    ShoppingListItem.objects.bulk_create(
+        (ShoppingListItem(user_id=row['user'],
+                          ingredient_id=row['recipe__recipes__ingredient'],
+                          amount=row['total'])
+         for row in totals.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0003_ingredient_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_relations,
+                             migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='ingredientforrecipe',
+            index=models.Index(fields=['recipe', 'ingredient', 'amount'], name='recipe_ingredient_amount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-pub_date', '-id'], name='recipe_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date'], name='recipe_author_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='favorites',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_favorites'),
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_shopping_cart'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.3 on 2026-10-17 06:07
+
+from django.db import migrations, models
+import foodgram.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0004_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='thumbnails',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Уменьшенные картинки'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(blank=True, upload_to=foodgram.models.recipe_image_path, verbose_name='Картинка'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 3.2.3 on 2026-10-17 06:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models.functions import Coalesce
+
+
+def fill_timelines(apps, schema_editor):
+    User = apps.get_model('foodgram', 'User')
+    Recipe = apps.get_model('foodgram', 'Recipe')
+    Subscriptions = apps.get_model('foodgram', 'Subscriptions')
+    TimelineEntry = apps.get_model('foodgram', 'TimelineEntry')
+    User.objects.update(subscribers_count=Coalesce(models.Subquery(
+        Subscriptions.objects.filter(
+            author=models.OuterRef('pk')
+        ).order_by().values('author').annotate(
+            count=models.Count('*')
+        ).values('count')
+    ), 0))
+    schema_editor.execute(
+        f'INSERT INTO {TimelineEntry._meta.db_table} '
+        f'(user_id, recipe_id, pub_date) '
+        f'SELECT subscription.user_id, recipe.id, recipe.pub_date '
+        f'FROM {Subscriptions._meta.db_table} subscription '
+        f'JOIN {Recipe._meta.db_table} recipe '
+        f'ON recipe.author_id = subscription.author_id'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0007_popularity_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='subscribers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписчиков'),
+        ),
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='Дата публикации')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='foodgram.recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+                'verbose_name_plural': 'Записи ленты',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-recipe'], name='timeline_user_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_timeline_entry'),
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
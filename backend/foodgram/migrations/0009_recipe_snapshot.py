@@ -0,0 +1,23 @@
+# Generated by Django 3.2.3 on 2026-10-17 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0008_subscription_feed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='snapshot',
+            field=models.TextField(blank=True, editable=False, null=True, verbose_name='Снимок ответа'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='snapshot_version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Версия снимка ответа'),
+        ),
+    ]
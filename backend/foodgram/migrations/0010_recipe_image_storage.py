@@ -0,0 +1,20 @@
+# Generated by Django 3.2.3 on 2026-10-17 07:35
+
+from django.db import migrations, models
+import foodgram.models
+import foodgram.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodgram', '0009_recipe_snapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(blank=True, storage=foodgram.storage.ContentAddressedStorage(), upload_to=foodgram.models.recipe_image_path, verbose_name='Картинка'),
+        ),
+    ]
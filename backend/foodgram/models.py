@@ -1,9 +1,36 @@
+import hashlib
+import os
+
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import EmptyResultSet
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models
+from django.db.models import Count, F, OuterRef, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
+from foodgram.search import search as full_text_search
+from foodgram.storage import ContentAddressedStorage
 from foodgram.validators import validator_username
 
 
+class LoadedValuesMixin:
+    """Значения полей, прочитанные из базы, в _loaded_values.
+
+    По ним сигналы замечают, что связь перенесли на другой объект.
+    """
+
+    _loaded_values = {}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values)
+            if value is not models.DEFERRED
+        }
+        return instance
+
+
 class User(AbstractUser):
     """Модель создания пользователя."""
 
@@ -38,6 +65,18 @@ class User(AbstractUser):
         blank=True,
     )
 
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False,
+    )
+
+    subscribers_count = models.PositiveIntegerField(
+        'Количество подписчиков',
+        default=0,
+        editable=False,
+    )
+
     class Meta:
         ordering = ('-id',)
         verbose_name = 'Пользователь'
@@ -93,12 +132,83 @@ class Ingredient(models.Model):
         ordering = ('-name',)
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = (
+            models.UniqueConstraint(fields=('name', 'measurement_unit'),
+                                    name='unique_ingredient'),
+        )
 
     def __str__(self):
         return self.name
 
 
-class Recipe(models.Model):
+def recipe_image_path(instance, filename):
+    """Имя файла картинки по хэшу содержимого.
+
+    Одинаковое содержимое даёт одинаковое имя, поэтому файлы можно
+    отдавать с бессрочными заголовками кэширования.
+    """
+    digest = hashlib.sha256()
+    for chunk in instance.image.file.chunks():
+        digest.update(chunk)
+    instance.image.file.seek(0)
+    extension = os.path.splitext(filename)[1].lower()
+    return f'recipes/{digest.hexdigest()[:32]}{extension}'
+
+
+def count_subquery(model, field):
+    """Число строк model, ссылающихся полем field на текущий объект."""
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            count=Count('*')
+        ).values('count')
+    ), 0)
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Запросы к рецептам."""
+
+    def invalidate_snapshots(self):
+        """Сброс снимков ответа у рецептов.
+
+        Версия увеличивается, чтобы снимок, собранный по данным до
+        изменения, не записался поверх сброса.
+        """
+        return self.update(snapshot=None,
+                           snapshot_version=F('snapshot_version') + 1)
+
+    def latest_by_author(self, authors, limit=None):
+        """Последние рецепты каждого из авторов одним запросом.
+
+        При заданном limit рецепты нумеруются ROW_NUMBER() в разрезе
+        автора, и из подзапроса берутся только первые limit строк.
+        Для пустого списка авторов запрос не строится.
+        """
+        queryset = self.filter(author__in=authors)
+        if limit is None:
+            return queryset
+        queryset = queryset.annotate(row_number=Window(
+            expression=RowNumber(),
+            partition_by=F('author'),
+            order_by=(F('pub_date').desc(), F('id').desc()),
+        ))
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return self.none()
+        return self.raw(
+            f'SELECT * FROM ({sql}) ranked WHERE ranked.row_number <= %s '
+            'ORDER BY ranked.pub_date DESC, ranked.id DESC',
+            (*params, limit),
+        )
+
+    def search(self, query):
+        """Полнотекстовый поиск по названию и описанию с ранжированием."""
+        return full_text_search(self, query)
+
+
+class Recipe(LoadedValuesMixin, models.Model):
     """Модель создания рецепта."""
 
     author = models.ForeignKey(
@@ -123,10 +233,31 @@ class Recipe(models.Model):
 
     image = models.ImageField(
         'Картинка',
-        upload_to='recipes/',
+        upload_to=recipe_image_path,
+        storage=ContentAddressedStorage(),
         blank=True,
     )
 
+    thumbnails = models.JSONField(
+        'Уменьшенные картинки',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+
+    snapshot = models.TextField(
+        'Снимок ответа',
+        null=True,
+        blank=True,
+        editable=False,
+    )
+
+    snapshot_version = models.PositiveIntegerField(
+        'Версия снимка ответа',
+        default=0,
+        editable=False,
+    )
+
     name = models.CharField(
         'Название',
         max_length=200,
@@ -150,10 +281,30 @@ class Recipe(models.Model):
         auto_now_add=True,
     )
 
+    favorites_count = models.PositiveIntegerField(
+        'В избранном',
+        default=0,
+        editable=False,
+    )
+
+    shopping_cart_count = models.PositiveIntegerField(
+        'В списках покупок',
+        default=0,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         ordering = ('-pub_date', )
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = (
+            models.Index(fields=('-pub_date', '-id'),
+                         name='recipe_pub_date_idx'),
+            models.Index(fields=('author', '-pub_date'),
+                         name='recipe_author_pub_date_idx'),
+        )
 
     def __str__(self):
         return self.name
@@ -184,9 +335,71 @@ class IngredientForRecipe(models.Model):
         verbose_name = 'Ингредиент в рецепте'
         verbose_name_plural = 'Ингредиенты в рецепте'
         unique_together = ('recipe', 'ingredient')
+        indexes = (
+            models.Index(fields=('recipe', 'ingredient', 'amount'),
+                         name='recipe_ingredient_amount_idx'),
+        )
+
+
+class RelationQuerySet(models.QuerySet):
+    """Запросы к связям пользователя с рецептом или автором.
+
+    Связи, сохранённые и удалённые через ORM, меняют счётчики
+    рецепта или автора в сигналах. add_many и remove_many пишут
+    в таблицу напрямую, без сигналов, и счётчики правит вызывающий.
+    """
+
+    def target_field(self):
+        return next(field for field in self.model._meta.concrete_fields
+                    if field.is_relation and field.name != 'user')
+
+    def add(self, user_id, target_id):
+        """Добавление связи одним запросом INSERT ... ON CONFLICT.
+
+        Повторная связь отсекается ограничением уникальности без
+        предварительной проверки, поэтому одновременные запросы не
+        создают дублей. Строка берётся из таблицы рецепта или автора,
+        так что несуществующий объект тоже ничего не добавляет.
+        Возвращает False, если связь не добавлена.
+        """
+        return bool(self.add_many(user_id, [target_id]))
+
+    def add_many(self, user_id, target_ids):
+        """Добавление нескольких связей, возвращает добавленные id."""
+        target = self.target_field()
+        related = target.related_model._meta
+        placeholders = ', '.join(['%s'] * len(target_ids))
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {self.model._meta.db_table} '
+                f'(user_id, {target.column}) '
+                f'SELECT %s, {related.pk.column} FROM {related.db_table} '
+                f'WHERE {related.pk.column} IN ({placeholders}) '
+                f'ON CONFLICT DO NOTHING RETURNING {target.column}',
+                [user_id, *target_ids],
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    def remove_many(self, user_id, target_ids=None):
+        """Удаление связей одним запросом, возвращает удалённые id.
+
+        Без target_ids удаляются все связи пользователя.
+        """
+        target = self.target_field()
+        condition = ''
+        if target_ids is not None:
+            placeholders = ', '.join(['%s'] * len(target_ids))
+            condition = f' AND {target.column} IN ({placeholders})'
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.model._meta.db_table} '
+                f'WHERE user_id = %s{condition} RETURNING {target.column}',
+                [user_id, *(target_ids or ())],
+            )
+            return {row[0] for row in cursor.fetchall()}
 
 
-class ShoppingCart(models.Model):
+class ShoppingCart(LoadedValuesMixin, models.Model):
     """Модель списка покупок."""
 
     user = models.ForeignKey(
@@ -203,13 +416,19 @@ class ShoppingCart(models.Model):
         verbose_name='Покупка',
     )
 
+    objects = RelationQuerySet.as_manager()
+
     class Meta:
         ordering = ('-id',)
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Список покупок'
+        constraints = (
+            models.UniqueConstraint(fields=('user', 'recipe'),
+                                    name='unique_shopping_cart'),
+        )
 
 
-class Favorites(models.Model):
+class Favorites(LoadedValuesMixin, models.Model):
     """Модель избранных рецептов."""
 
     user = models.ForeignKey(
@@ -226,13 +445,19 @@ class Favorites(models.Model):
         verbose_name='Рецепт',
     )
 
+    objects = RelationQuerySet.as_manager()
+
     class Meta:
         ordering = ('-id',)
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
+        constraints = (
+            models.UniqueConstraint(fields=('user', 'recipe'),
+                                    name='unique_favorites'),
+        )
 
 
-class Subscriptions(models.Model):
+class Subscriptions(LoadedValuesMixin, models.Model):
     """Модель подписок пользователя."""
 
     user = models.ForeignKey(
@@ -249,8 +474,314 @@ class Subscriptions(models.Model):
         verbose_name='Автор',
     )
 
+    objects = RelationQuerySet.as_manager()
+
     class Meta:
         unique_together = ('user', 'author')
         ordering = ('-id',)
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+    """Запросы к итогам списков покупок."""
+
+    def add_recipe(self, recipe_id, user_id=None, multiplier=1):
+        """Прибавление ингредиентов рецепта к итогам.
+
+        Без user_id изменяются итоги всех пользователей, у которых рецепт
+        лежит в корзине. Отрицательный multiplier вычитает рецепт, строки
+        с нулевым количеством удаляются.
+        """
+        table = self.model._meta.db_table
+        recipe_ingredients = IngredientForRecipe._meta.db_table
+        if user_id is None:
+            source = (
+                f'SELECT cart.user_id, ifr.ingredient_id, '
+                f'SUM(ifr.amount) * %s '
+                f'FROM {ShoppingCart._meta.db_table} cart '
+                f'JOIN {recipe_ingredients} ifr '
+                f'ON ifr.recipe_id = cart.recipe_id '
+                f'WHERE cart.recipe_id = %s '
+                f'GROUP BY cart.user_id, ifr.ingredient_id'
+            )
+            params = [multiplier, recipe_id]
+        else:
+            source = (
+                f'SELECT %s, ingredient_id, amount * %s '
+                f'FROM {recipe_ingredients} WHERE recipe_id = %s'
+            )
+            params = [user_id, multiplier, recipe_id]
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, ingredient_id, amount) '
+                f'{source} '
+                f'ON CONFLICT (user_id, ingredient_id) '
+                f'DO UPDATE SET amount = {table}.amount + excluded.amount',
+                params,
+            )
+        if multiplier < 0:
+            items = self.filter(amount__lte=0)
+            if user_id is None:
+                items = items.filter(user__shopping_cart__recipe=recipe_id)
+            else:
+                items = items.filter(user=user_id)
+            items.delete()
+
+    def add_amounts(self, recipe_id, amounts):
+        """Прибавление изменений количеств ингредиентов рецепта.
+
+        amounts - словарь {id ингредиента: изменение}. Меняются только
+        эти строки итогов у пользователей, у которых рецепт в корзине.
+        """
+        table = self.model._meta.db_table
+        deltas = ' UNION ALL '.join(
+            ['SELECT %s AS ingredient_id, %s AS amount'] * len(amounts)
+        )
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, ingredient_id, amount) '
+                f'SELECT cart.user_id, delta.ingredient_id, delta.amount '
+                f'FROM {ShoppingCart._meta.db_table} cart '
+                f'CROSS JOIN ({deltas}) delta '
+                f'WHERE cart.recipe_id = %s '
+                f'ON CONFLICT (user_id, ingredient_id) '
+                f'DO UPDATE SET amount = {table}.amount + excluded.amount',
+                [*(value for item in amounts.items() for value in item),
+                 recipe_id],
+            )
+        if min(amounts.values()) < 0:
+            self.filter(
+                amount__lte=0, ingredient__in=list(amounts),
+                user__shopping_cart__recipe=recipe_id,
+            ).delete()
+
+    def add_recipes(self, recipe_ids, user_id, multiplier=1):
+        """Прибавление ингредиентов нескольких рецептов к итогам."""
+        table = self.model._meta.db_table
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, ingredient_id, amount) '
+                f'SELECT %s, ingredient_id, SUM(amount) * %s '
+                f'FROM {IngredientForRecipe._meta.db_table} '
+                f'WHERE recipe_id IN ({placeholders}) '
+                f'GROUP BY ingredient_id '
+                f'ON CONFLICT (user_id, ingredient_id) '
+                f'DO UPDATE SET amount = {table}.amount + excluded.amount',
+                [user_id, multiplier, *recipe_ids],
+            )
+        if multiplier < 0:
+            self.filter(user=user_id, amount__lte=0).delete()
+
+    def expected(self, user_id=None):
+        """Итоги, посчитанные заново по корзинам пользователей."""
+        queryset = ShoppingCart.objects.filter(recipe__recipes__isnull=False)
+        if user_id is not None:
+            queryset = queryset.filter(user=user_id)
+        return queryset.values(
+            'user', 'recipe__recipes__ingredient'
+        ).annotate(
+            total=models.Sum('recipe__recipes__amount')
+        ).order_by()
+
+    def rebuild(self, user_id=None):
+        """Пересчёт итогов с нуля."""
+        items = self.all()
+        if user_id is not None:
+            items = items.filter(user=user_id)
+        items.delete()
+        self.bulk_create(
+            (self.model(user_id=row['user'],
+                        ingredient_id=row['recipe__recipes__ingredient'],
+                        amount=row['total'])
+             for row in self.expected(user_id).iterator()),
+            batch_size=1000,
+        )
+
+
+class ShoppingListItem(models.Model):
+    """Модель итогов списка покупок пользователя.
+
+    Суммы ингредиентов по всем рецептам корзины поддерживаются
+    при изменении корзины и рецептов, чтобы выгрузка списка покупок
+    не агрегировала корзину заново.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+    )
+
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Ингредиент',
+    )
+
+    amount = models.IntegerField(
+        'Количество',
+    )
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списка покупок'
+        constraints = (
+            models.UniqueConstraint(fields=('user', 'ingredient'),
+                                    name='unique_shopping_list_item'),
+        )
+
+
+class TimelineEntryQuerySet(models.QuerySet):
+    """Запросы к лентам подписок.
+
+    Рецепты авторов, у которых подписчиков не больше FEED_FANOUT_LIMIT,
+    раскладываются по лентам подписчиков при публикации. Рецепты более
+    популярных авторов в ленты не пишутся и добавляются при чтении.
+    """
+
+    def insert(self, source, params):
+        table = self.model._meta.db_table
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, recipe_id, pub_date) '
+                f'{source} ON CONFLICT (user_id, recipe_id) DO NOTHING',
+                params,
+            )
+
+    def fan_out(self, recipe):
+        """Запись нового рецепта в ленты подписчиков автора."""
+        if (User.objects.filter(pk=recipe.author_id).values_list(
+                'subscribers_count', flat=True
+        ).first() or 0) > settings.FEED_FANOUT_LIMIT:
+            return
+        self.insert(
+            f'SELECT user_id, %s, %s '
+            f'FROM {Subscriptions._meta.db_table} WHERE author_id = %s',
+            [recipe.id, recipe.pub_date, recipe.author_id],
+        )
+
+    def add_author(self, user_id, author_id):
+        """Рецепты автора в ленту нового подписчика.
+
+        Рецепты автора с числом подписчиков больше FEED_FANOUT_LIMIT
+        не копируются: они добавляются в ленту при чтении.
+        """
+        self.insert(
+            f'SELECT %s, recipe.id, recipe.pub_date '
+            f'FROM {Recipe._meta.db_table} recipe '
+            f'JOIN {User._meta.db_table} author '
+            f'ON author.id = recipe.author_id '
+            f'WHERE recipe.author_id = %s AND author.subscribers_count <= %s',
+            [user_id, author_id, settings.FEED_FANOUT_LIMIT],
+        )
+
+    def add_author_to_all(self, author_id):
+        """Рецепты автора в ленты всех подписчиков.
+
+        Нужно, когда автор опускается до FEED_FANOUT_LIMIT подписчиков
+        и его рецепты перестают добавляться в ленту при чтении.
+        """
+        self.insert(
+            f'SELECT subscription.user_id, recipe.id, recipe.pub_date '
+            f'FROM {Subscriptions._meta.db_table} subscription '
+            f'JOIN {Recipe._meta.db_table} recipe '
+            f'ON recipe.author_id = subscription.author_id '
+            f'WHERE subscription.author_id = %s',
+            [author_id],
+        )
+
+    def remove_author(self, user_id, author_id):
+        self.filter(user=user_id, recipe__author=author_id).delete()
+
+    def rebuild(self, user_id=None):
+        """Пересборка лент по подпискам с нуля."""
+        entries = self.all()
+        condition = 'author.subscribers_count <= %s'
+        params = [settings.FEED_FANOUT_LIMIT]
+        if user_id is not None:
+            entries = entries.filter(user=user_id)
+            condition += ' AND subscription.user_id = %s'
+            params.append(user_id)
+        entries.delete()
+        self.insert(
+            f'SELECT subscription.user_id, recipe.id, recipe.pub_date '
+            f'FROM {Subscriptions._meta.db_table} subscription '
+            f'JOIN {User._meta.db_table} author '
+            f'ON author.id = subscription.author_id '
+            f'JOIN {Recipe._meta.db_table} recipe '
+            f'ON recipe.author_id = subscription.author_id '
+            f'WHERE {condition}',
+            params,
+        )
+
+    def feed(self, user_id, limit, before=None):
+        """Ключи (pub_date, id рецепта) страницы ленты пользователя.
+
+        Страница из ленты сливается с последними рецептами популярных
+        авторов, на которых подписан пользователь. before - ключ
+        последнего рецепта предыдущей страницы.
+        """
+        entries = self.filter(user=user_id)
+        popular = Recipe.objects.filter(
+            author__in=Subscriptions.objects.filter(
+                user=user_id,
+                author__subscribers_count__gt=settings.FEED_FANOUT_LIMIT,
+            ).values('author')
+        )
+        if before is not None:
+            pub_date, recipe_id = before
+            entries = entries.filter(pub_date__lte=pub_date).exclude(
+                pub_date=pub_date, recipe_id__gte=recipe_id
+            )
+            popular = popular.filter(pub_date__lte=pub_date).exclude(
+                pub_date=pub_date, id__gte=recipe_id
+            )
+        keys = set(entries.order_by('-pub_date', '-recipe_id').values_list(
+            'pub_date', 'recipe_id'
+        )[:limit])
+        keys.update(popular.order_by('-pub_date', '-id').values_list(
+            'pub_date', 'id'
+        )[:limit])
+        return sorted(keys, reverse=True)[:limit]
+
+
+class TimelineEntry(models.Model):
+    """Модель записи в ленте подписок пользователя."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Пользователь',
+    )
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Рецепт',
+    )
+
+    pub_date = models.DateTimeField(
+        'Дата публикации',
+    )
+
+    objects = TimelineEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        constraints = (
+            models.UniqueConstraint(fields=('user', 'recipe'),
+                                    name='unique_timeline_entry'),
+        )
+        indexes = (
+            models.Index(fields=('user', '-pub_date', '-recipe'),
+                         name='timeline_user_pub_date_idx'),
+        )
@@ -0,0 +1,146 @@
+"""Полнотекстовый поиск рецептов.
+
+В PostgreSQL у таблицы рецептов есть столбец search_vector с весами
+для названия и описания на русском и английском, его заполняет триггер,
+а поиск идёт по GIN-индексу. В SQLite для локальной разработки
+используется отдельная таблица FTS5, которая обновляется сигналами.
+На остальных СУБД поиск сводится к icontains.
+"""
+import re
+
+from django.db import connections
+from django.db.models import Q
+
+FTS_TABLE = 'foodgram_recipe_fts'
+
+TS_QUERY = ("(websearch_to_tsquery('russian', %s) || "
+            "websearch_to_tsquery('english', %s))")
+
+POSTGRES_FUNCTION = """
+CREATE OR REPLACE FUNCTION foodgram_recipe_search_vector_update()
+RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('russian', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(NEW.text, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(NEW.text, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'ALTER TABLE foodgram_recipe ADD COLUMN search_vector tsvector'
+        )
+        schema_editor.execute(POSTGRES_FUNCTION)
+        schema_editor.execute(
+            'CREATE TRIGGER foodgram_recipe_search_vector_update '
+            'BEFORE INSERT OR UPDATE OF name, text ON foodgram_recipe '
+            'FOR EACH ROW EXECUTE PROCEDURE '
+            'foodgram_recipe_search_vector_update()'
+        )
+        schema_editor.execute('UPDATE foodgram_recipe SET name = name')
+        schema_editor.execute(
+            'CREATE INDEX foodgram_recipe_search_vector_idx '
+            'ON foodgram_recipe USING gin (search_vector)'
+        )
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE {FTS_TABLE} '
+            f"USING fts5(name, text, tokenize='unicode61')"
+        )
+        schema_editor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+            f'SELECT id, name, text FROM foodgram_recipe'
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'DROP TRIGGER foodgram_recipe_search_vector_update '
+            'ON foodgram_recipe'
+        )
+        schema_editor.execute(
+            'DROP FUNCTION foodgram_recipe_search_vector_update()'
+        )
+        schema_editor.execute(
+            'ALTER TABLE foodgram_recipe DROP COLUMN search_vector'
+        )
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE {FTS_TABLE}')
+
+
+def index_recipe(recipe, using='default'):
+    """Обновление записи рецепта в таблице FTS5 (только SQLite)."""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                       [recipe.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+            f'VALUES (%s, %s, %s)',
+            [recipe.pk, recipe.name, recipe.text],
+        )
+
+
+def unindex_recipe(recipe, using='default'):
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                       [recipe.pk])
+
+
+def rebuild_search_index(using='default'):
+    """Перестроение таблицы FTS5 после массовой загрузки рецептов."""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, text) '
+            f'SELECT id, name, text FROM foodgram_recipe'
+        )
+
+
+def search(queryset, query):
+    """Рецепты, подходящие под запрос, от более релевантных к менее.
+
+    Условие и ранг добавляются через extra(): индекс FTS должен
+    участвовать в соединении, а не в коррелированном подзапросе.
+    """
+    vendor = connections[queryset.db].vendor
+    table = queryset.model._meta.db_table
+    if vendor == 'postgresql':
+        queryset = queryset.extra(
+            select={'search_rank': f'ts_rank({table}.search_vector, '
+                                   f'{TS_QUERY})'},
+            select_params=(query, query),
+            where=[f'{table}.search_vector @@ {TS_QUERY}'],
+            params=(query, query),
+        )
+    elif vendor == 'sqlite':
+        words = re.findall(r'\w+', query)
+        if not words:
+            return queryset.none()
+        queryset = queryset.extra(
+            select={'search_rank': f'-bm25({FTS_TABLE}, 2.0, 1.0)'},
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE} MATCH %s', f'{FTS_TABLE}.rowid = {table}.id'],
+            params=[' '.join(f'"{word}"*' for word in words)],
+        )
+    else:
+        return queryset.filter(Q(name__icontains=query)
+                               | Q(text__icontains=query))
+    return queryset.order_by('-search_rank', '-pub_date')
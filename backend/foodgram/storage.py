@@ -0,0 +1,17 @@
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище файлов, названных по хэшу содержимого.
+
+    Файл с таким именем уже содержит те же байты, поэтому повторная
+    загрузка возвращает существующее имя, а не сохраняет копию
+    с суффиксом.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is not None and self.exists(name):
+            return name
+        return super().save(name, content, max_length)